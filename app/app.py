@@ -1,18 +1,58 @@
+import os
+import shutil
 from pathlib import Path
 
+from server.config import Settings
 from server.server import app
 
 __all__ = ["app"]
 
-if __name__ == "__main__":
+
+def worker_count() -> int:
+    if Settings.workers > 0:
+        return Settings.workers
+    # cpus this process may run on, which respects container cpusets
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def prepare_multiprocess_metrics():
+    """Let every worker write its metrics where /metrics can aggregate them."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        return
+    metrics_dir = Settings.base_dir / "logs" / "prometheus"
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir(parents=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(metrics_dir)
+
+
+def serve():
     import uvicorn
 
+    workers = worker_count()
+    if workers > 1:
+        prepare_multiprocess_metrics()
+
     module = Path(__file__).stem
+    # workers are spawned and import the app themselves, so every cache, http
+    # pool and mongo client is created per worker; uvloop and httptools are
+    # picked by "auto" when installed (uvicorn[standard])
     uvicorn.run(
         f"{module}:app",
-        host="0.0.0.0",
-        port=8000,
+        host=Settings.host,
+        port=Settings.port,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        limit_concurrency=Settings.limit_concurrency or None,
+        backlog=Settings.backlog,
+        timeout_keep_alive=Settings.keep_alive_timeout,
+        timeout_graceful_shutdown=Settings.graceful_shutdown_timeout,
         # reload=True,
         # access_log=False,
-        workers=1,
     )
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,8 +1,13 @@
 from fastapi_mongo_base.models import BusinessEntity
 from pymongo import ASCENDING, IndexModel
 
+from server.config import Settings
+from utils.cache import TTLCache
+
 from .schemas import Config
 
+config_cache = TTLCache(ttl=Settings.config_cache_ttl, name="config")
+
 
 class Configuration(Config, BusinessEntity):
     class Settings:
@@ -12,4 +17,14 @@ class Configuration(Config, BusinessEntity):
 
     @classmethod
     async def get_config(cls, business_name: str) -> "Configuration":
-        return await cls.find_one({"business_name": business_name})
+        return await config_cache.get_or_load(
+            business_name,
+            lambda: cls.find_one({"business_name": business_name}),
+        )
+
+    @classmethod
+    def invalidate_config(cls, business_name: str = None):
+        if business_name is None:
+            config_cache.invalidate()
+        else:
+            config_cache.invalidate(business_name)
@@ -1,7 +1,10 @@
+import uuid
+
 from fastapi import Request
 from fastapi_mongo_base.core.exceptions import BaseHTTPException
 from ufaas_fastapi_business.routes import AbstractAuthRouter
-from usso.fastapi import jwt_access_security
+
+from utils.jwt_cache import jwt_access_security
 
 from .models import Configuration
 from .schemas import Config
@@ -25,5 +28,20 @@ class ConfigRouter(AbstractAuthRouter[Configuration, Config]):
     async def list_items(self, request: Request, offset: int = 0, limit: int = 10):
         return await super().list_items(request, offset, limit)
 
+    async def create_item(self, request: Request, data: dict):
+        item: Configuration = await super().create_item(request, data)
+        Configuration.invalidate_config(item.business_name)
+        return item
+
+    async def update_item(self, request: Request, uid: uuid.UUID, data: dict):
+        item: Configuration = await super().update_item(request, uid, data)
+        Configuration.invalidate_config(item.business_name)
+        return item
+
+    async def delete_item(self, request: Request, uid: uuid.UUID):
+        item: Configuration = await super().delete_item(request, uid)
+        Configuration.invalidate_config(item.business_name)
+        return item
+
 
 router = ConfigRouter().router
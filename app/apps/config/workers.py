@@ -0,0 +1,74 @@
+"""Background workers of the config app."""
+
+import asyncio
+import logging
+
+from pymongo.errors import OperationFailure
+
+from server.config import Settings
+
+from .models import Configuration, config_cache
+
+
+def use_cache_ttl(streaming: bool):
+    """Cache for the full ttl only while the change stream carries the writes
+    of the other processes."""
+    if streaming:
+        config_cache.ttl = Settings.config_cache_ttl
+    else:
+        config_cache.ttl = min(
+            Settings.config_cache_ttl, Settings.config_cache_fallback_ttl
+        )
+
+
+def stream_unsupported(error: Exception) -> bool:
+    # 40573: change streams are only supported on replica sets
+    return isinstance(error, OperationFailure) and error.code == 40573
+
+
+async def watch_configurations():
+    """Invalidate cached configurations on every change of the collection.
+
+    A broken stream is reopened with exponential backoff. Change streams need
+    a replica set; without one the cache falls back to its shorter ttl.
+    """
+    collection = Configuration.get_motor_collection()
+    delay = Settings.config_stream_backoff_base
+    while True:
+        try:
+            async with collection.watch(full_document="updateLookup") as stream:
+                use_cache_ttl(streaming=True)
+                # changes made while the stream was down were missed
+                Configuration.invalidate_config()
+                delay = Settings.config_stream_backoff_base
+                async for change in stream:
+                    document = change.get("fullDocument") or {}
+                    # deletes carry no document, drop everything to be safe
+                    Configuration.invalidate_config(document.get("business_name"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            use_cache_ttl(streaming=False)
+            if stream_unsupported(e):
+                logging.warning(
+                    f"configuration change stream unavailable, using TTL: {e}"
+                )
+                return
+            logging.warning(
+                f"configuration change stream failed, retrying in {delay}s: {e}"
+            )
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, Settings.config_stream_backoff_max)
+
+
+def start_workers() -> list[asyncio.Task]:
+    if not Settings.config_change_stream:
+        use_cache_ttl(streaming=False)
+        return []
+    return [asyncio.create_task(watch_configurations())]
+
+
+async def stop_workers(tasks: list[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,93 @@
+"""Server-to-server purchase status callbacks of the ipgs.
+
+An ipg pushes `{"uid": <purchase uid>, "status": "SUCCESS" | "FAILED"}` to
+`POST /payments/callback` on the business domain when a purchase closes,
+either signed with `IPG_CALLBACK_SECRET`:
+
+    X-Timestamp: <unix seconds>
+    X-Signature: sha256=<hex hmac-sha256 of f"{timestamp}." + body>
+
+or with a business token of the business. App tokens are refused, since any
+app installed on the business could then close any purchase. The payment is
+found by its indexed `tries.uid` and updated with the same compare-and-set as
+the polls of verify, so callbacks and polls can race safely.
+"""
+
+import hashlib
+import hmac
+import logging
+import time
+
+from beanie.odm.utils.encoder import Encoder
+from fastapi import Request
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+from ufaas_fastapi_business.middlewares import authorization_middleware
+from ufaas_fastapi_business.models import Business
+
+from server.config import Settings
+
+from .models import Payment
+from .schemas import PurchaseCallbackSchema, PurchaseStatus
+
+SIGNATURE_HEADER = "X-Signature"
+TIMESTAMP_HEADER = "X-Timestamp"
+
+
+def callback_signature(timestamp: str, body: bytes) -> str:
+    return hmac.new(
+        Settings.ipg_callback_secret.encode(),
+        f"{timestamp}.".encode() + body,
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def valid_callback_signature(request: Request, body: bytes) -> bool:
+    if not Settings.ipg_callback_secret:
+        return False
+    timestamp = request.headers.get(TIMESTAMP_HEADER, "")
+    if not timestamp.isdigit():
+        return False
+    # a captured callback can not be replayed later on
+    if abs(time.time() - int(timestamp)) > Settings.ipg_callback_max_skew:
+        return False
+    signature = request.headers.get(SIGNATURE_HEADER, "").removeprefix("sha256=")
+    return hmac.compare_digest(signature, callback_signature(timestamp, body))
+
+
+async def authorize_callback(request: Request, body: bytes):
+    if SIGNATURE_HEADER in request.headers:
+        if valid_callback_signature(request, body):
+            return
+    else:
+        auth = await authorization_middleware(request, anonymous_accepted=True)
+        if auth.issuer_type == "Business":
+            return
+    raise BaseHTTPException(401, "unauthorized", "Unauthorized")
+
+
+async def apply_purchase_callback(
+    business: Business, data: PurchaseCallbackSchema
+) -> Payment:
+    payment = await Payment.find_one(
+        {
+            "business_name": business.name,
+            "is_deleted": False,
+            "tries.uid": Encoder().encode(data.uid),
+        }
+    )
+    tries = [try_ for try_ in payment.tries if try_.uid == data.uid] if payment else []
+    if not tries or (data.ipg and tries[0].ipg != data.ipg):
+        raise BaseHTTPException(404, "purchase_not_found", "Purchase not found")
+
+    # open statuses carry no news, refunds are not handled by verify either
+    if data.status not in (PurchaseStatus.SUCCESS, PurchaseStatus.FAILED):
+        return payment
+
+    # a lost compare-and-set reloads the payment, so retry on the new state
+    for _ in range(3):
+        if await payment.apply_purchase_statuses({data.uid: data.status}):
+            break
+        if any(t.uid == data.uid and t.status == data.status for t in payment.tries):
+            break
+    logging.info(f"callback {tries[0].ipg} {data.uid} {data.status}: {payment.status}")
+    return payment
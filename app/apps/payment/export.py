@@ -0,0 +1,111 @@
+"""Streaming export of payments as NDJSON or CSV.
+
+Documents are read from a raw Mongo cursor with a projection and encoded
+row by row, so memory stays flat no matter how many payments are exported.
+"""
+
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from typing import AsyncIterator, Literal
+
+from beanie.odm.utils.encoder import Encoder
+from bson import Binary, Decimal128, ObjectId
+from pymongo import DESCENDING
+
+from .models import Payment
+from .schemas import PaymentSchema
+
+ExportFormat = Literal["ndjson", "csv"]
+
+DEFAULT_EXPORT_FIELDS = [
+    "uid",
+    "created_at",
+    "user_id",
+    "wallet_id",
+    "amount",
+    "currency",
+    "status",
+    "description",
+    "verified_at",
+    "ref_id",
+    "is_test",
+]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def parse_export_fields(fields: str | None) -> list[str]:
+    if not fields:
+        return DEFAULT_EXPORT_FIELDS
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in PaymentSchema.model_fields]
+    if unknown:
+        raise ValueError(f"Unknown export fields {unknown}")
+    return requested
+
+
+def jsonable(value):
+    """Convert raw bson values into json compatible ones."""
+    if isinstance(value, Binary) and value.subtype == 4:
+        return str(value.as_uuid())
+    if isinstance(value, (uuid.UUID, ObjectId, Decimal128, Decimal)):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, dict):
+        return {key: jsonable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [jsonable(item) for item in value]
+    return value
+
+
+async def iter_payment_rows(
+    fields: list[str], batch_size: int = 500, **filters
+) -> AsyncIterator[dict]:
+    query = Encoder().encode({"$and": Payment.get_queryset(**filters)})
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    cursor = (
+        Payment.get_motor_collection()
+        .find(query, projection)
+        .sort([("created_at", DESCENDING), ("uid", DESCENDING)])
+        .batch_size(batch_size)
+    )
+    async for document in cursor:
+        yield {field: jsonable(document.get(field)) for field in fields}
+
+
+async def ndjson_lines(rows: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+async def csv_lines(rows: AsyncIterator[dict], fields: list[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    async for row in rows:
+        writer.writerow(
+            {
+                key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                for key, value in row.items()
+            }
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.getvalue():
+        # header only, nothing matched
+        yield buffer.getvalue()
+
+
+def export_payments(format: ExportFormat, fields: list[str], **filters):
+    rows = iter_payment_rows(fields, **filters)
+    if format == "csv":
+        return csv_lines(rows, fields)
+    return ndjson_lines(rows)
@@ -1,15 +1,85 @@
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
+from typing import ClassVar
 
+from beanie import PydanticObjectId, UpdateResponse
+from beanie.odm.utils.encoder import Encoder
 from fastapi_mongo_base.models import BusinessOwnedEntity
 from fastapi_mongo_base.utils import bsontools
 from pydantic import field_serializer, field_validator
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
-from .schemas import PaymentSchema, PaymentStatus
+from server.config import Settings
+from utils.pagination import keyset_query
+
+from .schemas import (
+    PaymentCreateSchema,
+    PaymentSchema,
+    PaymentStatus,
+    ProposalOutboxSchema,
+    ProposalStatus,
+    PurchaseSchema,
+    PurchaseStatus,
+)
+
+OPEN_STATUSES = [PaymentStatus.INIT, PaymentStatus.PENDING]
+# a late capture overrides an expiry, refunds are never undone
+SUCCEEDABLE_STATUSES = OPEN_STATUSES + [PaymentStatus.FAILED]
 
 
 class Payment(PaymentSchema, BusinessOwnedEntity):
+    # outbox state of the core proposal, internal and never in api responses
+    proposal: ProposalOutboxSchema | None = None
+
+    private_fields: ClassVar[set[str]] = {"proposal"}
+
     class Settings:
-        indexes = BusinessOwnedEntity.Settings.indexes
+        indexes = BusinessOwnedEntity.Settings.indexes + [
+            # list queries: business/user filters sorted by the keyset cursor
+            IndexModel(
+                [
+                    ("business_name", ASCENDING),
+                    ("user_id", ASCENDING),
+                    ("created_at", DESCENDING),
+                    ("uid", DESCENDING),
+                ]
+            ),
+            IndexModel(
+                [
+                    ("business_name", ASCENDING),
+                    ("created_at", DESCENDING),
+                    ("uid", DESCENDING),
+                ]
+            ),
+            # open payments by age, for reconciliation pages and expiry
+            # (partial $in needs 6.0+)
+            IndexModel(
+                [("status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+                name="open_status_created_at_id",
+                partialFilterExpression={
+                    "status": {"$in": [status.value for status in OPEN_STATUSES]}
+                },
+            ),
+            # expired payments with a try still open at the ipg, by age
+            IndexModel(
+                [("created_at", ASCENDING), ("_id", ASCENDING)],
+                name="expired_open_tries_created_at_id",
+                partialFilterExpression={
+                    "status": PaymentStatus.FAILED.value,
+                    "tries.status": {"$in": [status.value for status in OPEN_STATUSES]},
+                },
+            ),
+            IndexModel([("tries.uid", ASCENDING)]),
+            # proposal outbox entries only, for the workers and the metrics
+            IndexModel(
+                [
+                    ("proposal.status", ASCENDING),
+                    ("proposal.next_attempt_at", ASCENDING),
+                ],
+                name="proposal_outbox",
+                partialFilterExpression={"proposal.status": {"$exists": True}},
+            ),
+        ]
 
     @field_validator("amount", mode="before")
     def validate_amount(cls, value):
@@ -24,55 +94,356 @@ class Payment(PaymentSchema, BusinessOwnedEntity):
         return str(value)
 
     @classmethod
-    async def get_payment_by_code(cls, business_name: str, code: str):
-        return await cls.find_one(
-            cls.is_deleted == False,
-            cls.business_name == business_name,
-            cls.code == code,
-        )
+    def from_create_schema(cls, data: PaymentCreateSchema, **fields) -> "Payment":
+        """Build a payment from a validated create schema without dumping it."""
+        return cls.model_validate({**data.__dict__, **fields})
 
     async def get_business(self):
-        from ufaas_fastapi_business.models import Business
+        from utils.business import get_business_by_name
 
-        return await Business.get_by_name(self.business_name)
+        return await get_business_by_name(self.business_name)
 
-    async def success(self, ref_id: int):
-        self.ref_id = ref_id
-        self.status = "SUCCESS"
-        self.verified_at = datetime.now()
-        await self.save()
+    async def compare_and_set(
+        self,
+        update: dict,
+        expected_status: list[PaymentStatus] | None = None,
+        array_filters: list[dict] | None = None,
+        query: dict | None = None,
+    ) -> bool:
+        """Atomically apply `update` if the stored status is one of `expected_status`.
+
+        Returns whether the document was modified. On a lost race the model is
+        reloaded so callers see the state written by the winner.
+        """
+        query = {**(query or {}), "uid": self.uid}
+        if expected_status is not None:
+            query["status"] = {"$in": [status.value for status in expected_status]}
+        kwargs = {}
+        if array_filters:
+            kwargs["array_filters"] = Encoder().encode(array_filters)
+
+        result = await self.__class__.find_one(query).update(update, **kwargs)
+        if result.modified_count:
+            return True
+        await self.sync()
+        return False
+
+    def new_proposal(self) -> ProposalOutboxSchema | None:
+        """Outbox entry of the core proposal to record with the SUCCESS transition."""
+        if self.amount == 0:
+            return None
+        return ProposalOutboxSchema()
+
+    async def success(self, ref_id: int = None):
+        now = datetime.now()
+        proposal = self.new_proposal()
+        updated = await self.compare_and_set(
+            {
+                "$set": {
+                    "status": PaymentStatus.SUCCESS.value,
+                    "verified_at": now,
+                    "ref_id": ref_id,
+                    "proposal": Encoder().encode(proposal),
+                    "updated_at": now,
+                }
+            },
+            expected_status=SUCCEEDABLE_STATUSES,
+        )
+        if updated:
+            self.status = PaymentStatus.SUCCESS
+            self.verified_at = now
+            self.ref_id = ref_id
+            self.proposal = proposal
+        return updated
 
     async def fail(self, failure_reason: str = None):
-        self.status = "FAILED"
-        self.failure_reason = failure_reason
-        await self.save()
+        now = datetime.now()
+        updated = await self.compare_and_set(
+            {
+                "$set": {
+                    "status": PaymentStatus.FAILED.value,
+                    "failure_reason": failure_reason,
+                    "updated_at": now,
+                }
+            },
+            expected_status=OPEN_STATUSES,
+        )
+        if updated:
+            self.status = PaymentStatus.FAILED
+            self.failure_reason = failure_reason
+        return updated
 
-    async def success_purchase(self, uid: str):
+    async def add_try(self, purchase: PurchaseSchema) -> bool:
+        """Push a started purchase and mark the payment pending, if still open."""
+        updated = await self.compare_and_set(
+            {
+                "$push": {"tries": Encoder().encode(purchase.model_dump())},
+                "$set": {
+                    "status": PaymentStatus.PENDING.value,
+                    "updated_at": datetime.now(),
+                },
+            },
+            expected_status=OPEN_STATUSES,
+        )
+        if updated:
+            self.tries.append(purchase)
+            self.status = PaymentStatus.PENDING
+        return updated
+
+    def set_purchase_status(self, uid: str, status: PurchaseStatus) -> bool:
+        """Apply a closed purchase status to its try and the payment, in memory.
+
+        Returns whether anything changed and needs to be persisted.
+        """
+        changed = False
         for try_ in self.tries:
             if try_.uid == uid:
-                try_.status = "SUCCESS"
-                try_.verified_at = datetime.now()
+                if try_.status != status:
+                    try_.status = status
+                    try_.verified_at = datetime.now()
+                    changed = True
                 break
-        if self.status == "SUCCESS":
-            return
-        self.status = "SUCCESS"
-        self.verified_at = datetime.now()
-        await self.save()
+
+        if status == PurchaseStatus.SUCCESS and self.status in SUCCEEDABLE_STATUSES:
+            self.status = PaymentStatus.SUCCESS
+            self.verified_at = datetime.now()
+            changed = True
+        elif (
+            status == PurchaseStatus.FAILED
+            and self.status.is_open()
+            and self.is_overdue()
+        ):
+            self.status = PaymentStatus.FAILED
+            changed = True
+        return changed
+
+    async def apply_purchase_statuses(
+        self, statuses: dict[uuid.UUID | None, PurchaseStatus]
+    ) -> bool:
+        """Persist closed purchase statuses in one compare-and-set write.
+
+        The write only applies if the stored payment status is still the one
+        the statuses were folded onto, so concurrent verifies do not clobber
+        each other.
+        """
+        expected_status = self.status
+        changed = False
+        for uid, status in statuses.items():
+            changed |= self.set_purchase_status(uid, status)
+        if not changed:
+            return False
+
+        update = {"updated_at": datetime.now()}
+        query = None
+        array_filters = []
+        tries = [try_ for try_ in self.tries if try_.uid in statuses]
+        if len(tries) == 1:
+            # a single try is addressed with the positional operator
+            query = {"tries.uid": Encoder().encode(tries[0].uid)}
+            update["tries.$.status"] = tries[0].status.value
+            update["tries.$.verified_at"] = tries[0].verified_at
+        else:
+            for i, try_ in enumerate(tries):
+                update[f"tries.$[t{i}].status"] = try_.status.value
+                update[f"tries.$[t{i}].verified_at"] = try_.verified_at
+                array_filters.append({f"t{i}.uid": try_.uid})
+        expected = [expected_status]
+        if self.status != expected_status:
+            update["status"] = self.status.value
+            if self.status == PaymentStatus.SUCCESS:
+                # only lands on a payment that may still succeed, never a refund
+                expected = [s for s in expected if s in SUCCEEDABLE_STATUSES]
+                update["verified_at"] = self.verified_at
+                # the outbox entry is written with the transition, never apart
+                self.proposal = self.new_proposal()
+                update["proposal"] = Encoder().encode(self.proposal)
+
+        return await self.compare_and_set(
+            {"$set": update},
+            expected_status=expected,
+            array_filters=array_filters,
+            query=query,
+        )
+
+    async def success_purchase(self, uid: str):
+        return await self.apply_purchase_statuses({uid: PurchaseStatus.SUCCESS})
 
     async def fail_purchase(self, uid: str):
-        for try_ in self.tries:
-            if try_.uid == uid:
-                try_.status = "FAILED"
-                try_.verified_at = datetime.now()
-                break
-        if self.is_overdue():
-            self.status = "FAILED"
-        await self.save()
+        return await self.apply_purchase_statuses({uid: PurchaseStatus.FAILED})
 
-    @property
-    def is_successful(self):
-        return self.status == "SUCCESS"
+    @classmethod
+    async def list_page(
+        cls,
+        business_name: str,
+        user_id: uuid.UUID = None,
+        cursor: tuple[datetime, uuid.UUID] = None,
+        offset: int = 0,
+        limit: int = 10,
+        **kwargs,
+    ) -> list["Payment"]:
+        """List payments newest first, after a keyset cursor or at an offset."""
+        query = cls.get_queryset(user_id=user_id, business_name=business_name, **kwargs)
+        if cursor:
+            query.append(keyset_query(*cursor))
+        items_query = cls.find({"$and": query}).sort(
+            [("created_at", DESCENDING), ("uid", DESCENDING)]
+        )
+        if offset and not cursor:
+            items_query = items_query.skip(offset)
+        return await items_query.limit(limit).to_list()
+
+    @classmethod
+    async def list_pending(
+        cls,
+        expired: bool = False,
+        after: tuple[datetime, PydanticObjectId] = None,
+        created_before: datetime = None,
+        limit: int = 100,
+    ) -> list["Payment"]:
+        """Page through the payments to reconcile, oldest first.
+
+        These are the pending payments or, with `expired`, those expired up to
+        `reconcile_failed_grace` after creation with a try still open at the
+        ipg, since such a try can still capture. Pages follow the
+        `(created_at, _id)` keyset of the last payment of the previous page.
+        """
+        created_at = {}
+        if expired:
+            query = {
+                "status": PaymentStatus.FAILED.value,
+                "tries.status": {"$in": [status.value for status in OPEN_STATUSES]},
+            }
+            created_at["$gte"] = datetime.now() - timedelta(
+                seconds=Settings.reconcile_failed_grace
+            )
+        else:
+            query = {"status": PaymentStatus.PENDING.value}
+        if created_before:
+            created_at["$lt"] = created_before
+        if created_at:
+            query["created_at"] = created_at
+        query["is_deleted"] = False
+
+        conditions = [query]
+        if after:
+            conditions.append(
+                {
+                    "$or": [
+                        {"created_at": {"$gt": after[0]}},
+                        {"created_at": after[0], "_id": {"$gt": after[1]}},
+                    ]
+                }
+            )
+        return (
+            await cls.find({"$and": conditions})
+            .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+            .limit(limit)
+            .to_list()
+        )
+
+    @classmethod
+    async def expire_overdue(cls) -> int:
+        """Fail every open payment past its duration. Returns how many expired."""
+        open_query = {
+            "is_deleted": False,
+            "status": {"$in": [status.value for status in OPEN_STATUSES]},
+        }
+        now = datetime.now()
+        expired = 0
+        # one update_many per distinct duration, which is a single one in practice
+        for duration in await cls.distinct("duration", open_query):
+            result = await cls.find(
+                {
+                    **open_query,
+                    "duration": duration,
+                    "created_at": {"$lt": now - timedelta(seconds=duration)},
+                }
+            ).update_many(
+                {
+                    "$set": {
+                        "status": PaymentStatus.FAILED.value,
+                        "failure_reason": "Payment is overdue",
+                        "updated_at": now,
+                    }
+                }
+            )
+            expired += result.modified_count
+        return expired
+
+    @classmethod
+    async def claim_proposal(cls, lease: float) -> "Payment | None":
+        """Lease the next due outbox proposal to the calling worker."""
+        now = datetime.now()
+        return await cls.find_one(
+            {
+                "$or": [
+                    {
+                        "proposal.status": ProposalStatus.PENDING.value,
+                        "proposal.next_attempt_at": {"$lte": now},
+                    },
+                    {
+                        "proposal.status": ProposalStatus.PROCESSING.value,
+                        "proposal.locked_until": {"$lte": now},
+                    },
+                ]
+            }
+        ).update(
+            {
+                "$set": {
+                    "proposal.status": ProposalStatus.PROCESSING.value,
+                    "proposal.locked_until": now + timedelta(seconds=lease),
+                },
+                "$inc": {"proposal.attempts": 1},
+            },
+            response_type=UpdateResponse.NEW_DOCUMENT,
+        )
+
+    @classmethod
+    async def count_pending_proposals(cls) -> int:
+        """Outbox proposals that are not sent yet, including leased ones."""
+        return await cls.find(
+            {
+                "proposal.status": {
+                    "$in": [
+                        ProposalStatus.PENDING.value,
+                        ProposalStatus.PROCESSING.value,
+                    ]
+                }
+            }
+        ).count()
+
+    async def release_proposal(
+        self, error: str = None, next_attempt_at: datetime = None
+    ) -> bool:
+        """Close the leased outbox proposal as done, retry later or failed.
+
+        Fenced on the attempt of the lease, so a worker whose lease expired
+        can not release a proposal another worker has claimed since.
+        """
+        if error is None:
+            status = ProposalStatus.DONE
+        elif next_attempt_at is None:
+            status = ProposalStatus.FAILED
+        else:
+            status = ProposalStatus.PENDING
+        return await self.compare_and_set(
+            {
+                "$set": {
+                    "proposal.status": status.value,
+                    "proposal.next_attempt_at": next_attempt_at or datetime.now(),
+                    "proposal.locked_until": None,
+                    "proposal.last_error": error,
+                }
+            },
+            query={
+                "proposal.idempotency_key": Encoder().encode(
+                    self.proposal.idempotency_key
+                ),
+                "proposal.status": ProposalStatus.PROCESSING.value,
+                "proposal.attempts": self.proposal.attempts,
+            },
+        )
 
     @property
-    def start_payment_url(self):
-        return self.config.payment_request_url(self.code)
+    def is_successful(self):
+        return self.status == "SUCCESS"
\ No newline at end of file
@@ -1,43 +1,105 @@
+import asyncio
 import logging
 import uuid
+from datetime import datetime
 from decimal import Decimal
 
-from fastapi import Request
-from fastapi.responses import RedirectResponse
+import httpx
+from fastapi import Query, Request
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi_mongo_base.core.exceptions import BaseHTTPException
 from fastapi_mongo_base.utils import basic
-from ufaas_fastapi_business.middlewares import authorization_middleware, get_business
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from ufaas_fastapi_business.middlewares import (
+    AuthorizationData,
+    authorization_middleware,
+)
 from ufaas_fastapi_business.routes import AbstractAuthRouter
 
+from server.config import Settings
+from utils.business import get_business
+from utils.pagination import decode_cursor, encode_cursor
+from utils.profiling import ProfilingRoute
+from utils.resilience import UpstreamUnavailable
+from utils.responses import document_response
+
 from ..config.models import Configuration
+from .callbacks import apply_purchase_callback, authorize_callback
+from .export import MEDIA_TYPES, ExportFormat, export_payments, parse_export_fields
 from .models import Payment
 from .schemas import (
+    PaymentBulkCreateSchema,
+    PaymentBulkResponseSchema,
+    PaymentBulkResultSchema,
     PaymentCreateSchema,
+    PaymentListSchema,
     PaymentRetrieveSchema,
     PaymentSchema,
     PaymentStatus,
     PaymentUpdateSchema,
+    PurchaseCallbackResponseSchema,
+    PurchaseCallbackSchema,
 )
 from .services import (
-    create_proposal,
     get_wallets,
     payments_options,
+    start_new_payment,
     start_payment,
     verify_payment,
 )
 
 
+async def partial_lookup(name: str, lookup):
+    """Await an upstream lookup of the retrieve response.
+
+    In partial-response mode a lookup that times out or fails yields `None`,
+    so the payment is still returned without that field.
+    """
+    if not Settings.retrieve_partial_response:
+        return await lookup
+    try:
+        return await asyncio.wait_for(lookup, timeout=Settings.retrieve_lookup_timeout)
+    except (asyncio.TimeoutError, httpx.HTTPError, UpstreamUnavailable) as e:
+        logging.warning(f"retrieve lookup {name} skipped: {type(e).__name__} {e}")
+        return None
+
+
 class PaymentRouter(AbstractAuthRouter[Payment, PaymentSchema]):
     def __init__(self):
-        super().__init__(model=Payment, schema=PaymentSchema, user_dependency=None)
+        super().__init__(
+            model=Payment,
+            schema=PaymentSchema,
+            user_dependency=None,
+            route_class=ProfilingRoute,
+        )
 
     def config_schemas(self, schema, **kwargs):
         super().config_schemas(schema)
         self.create_request_schema = PaymentCreateSchema
         self.retrieve_response_schema = PaymentRetrieveSchema
+        self.list_response_schema = PaymentListSchema
 
     def config_routes(self, **kwargs):
         super().config_routes(update_route=False, delete_route=False, **kwargs)
+        self.router.add_api_route(
+            "/bulk",
+            self.create_items_bulk,
+            methods=["POST"],
+            response_model=PaymentBulkResponseSchema,
+        )
+        self.router.add_api_route(
+            "/callback",
+            self.purchase_callback,
+            methods=["POST"],
+            response_model=PurchaseCallbackResponseSchema,
+        )
+        self.router.add_api_route(
+            "/export",
+            self.export_items,
+            methods=["GET"],
+            response_class=StreamingResponse,
+        )
         self.router.add_api_route(
             "/start",
             self.start_direct_payment,
@@ -60,43 +122,194 @@ class PaymentRouter(AbstractAuthRouter[Payment, PaymentSchema]):
         auth = await authorization_middleware(request, anonymous_accepted=True)
         if request.method in ["POST", "PATCH", "DELETE"]:
             if not auth.user_id:
-                raise BaseHTTPException(status_code=401, detail="Unauthorized")
+                raise BaseHTTPException(401, "unauthorized", "Unauthorized")
         return auth
 
-    async def retrieve_item(self, request: Request, uid: uuid.UUID):
+    async def list_items(
+        self,
+        request: Request,
+        offset: int = Query(0, ge=0),
+        limit: int = Query(10, ge=1, le=Settings.page_max_limit),
+        cursor: str | None = None,
+        status: PaymentStatus | None = None,
+        user_id: uuid.UUID | None = None,
+        created_at_from: datetime | None = None,
+        created_at_to: datetime | None = None,
+    ):
+        """List payments newest first.
+
+        Pass the `next_cursor` of a page as `cursor` to get the next one; deep
+        pages then cost the same as the first. `offset` paging still works but
+        skips over every earlier payment.
+        """
+        # business and app issuers filter by user_id, users only see their own
         auth = await self.get_auth(request)
-        item = await self.get_item(uid, business_name=auth.business.name)
-        if auth.user_id:
-            wallets = await get_wallets(auth.business, auth.user_id)
-        else:
-            wallets = None
-        options = await payments_options(item)
-        return self.retrieve_response_schema(
-            **item.model_dump(), ipgs=options, wallets=wallets
+        if auth.issuer_type not in ("User", "Business", "App"):
+            raise BaseHTTPException(401, "unauthorized", "Unauthorized")
+        filters = dict(
+            business_name=auth.business.name,
+            user_id=auth.user_id,
+            status=status,
+            created_at_from=created_at_from,
+            created_at_to=created_at_to,
+        )
+        items = await self.model.list_page(
+            cursor=decode_cursor(cursor) if cursor else None,
+            offset=offset,
+            limit=limit,
+            **filters,
+        )
+        next_cursor = (
+            encode_cursor(items[-1].created_at, items[-1].uid)
+            if len(items) == limit
+            else None
+        )
+        return PaymentListSchema(
+            items=items,
+            total=None if cursor else await self.model.total_count(**filters),
+            offset=0 if cursor else offset,
+            limit=limit,
+            next_cursor=next_cursor,
         )
 
-    async def create_item(self, request: Request, data: PaymentCreateSchema):
+    async def export_items(
+        self,
+        request: Request,
+        format: ExportFormat = "ndjson",
+        fields: str | None = None,
+        status: PaymentStatus | None = None,
+        user_id: uuid.UUID | None = None,
+        created_at_from: datetime | None = None,
+        created_at_to: datetime | None = None,
+    ):
+        """Stream every matching payment, newest first, as NDJSON or CSV.
+
+        `fields` is a comma separated projection of payment fields.
+        """
         auth = await self.get_auth(request)
+        # business and app issuers export all payments unless they ask for a user
+        if auth.issuer_type == "User":
+            user_id = auth.user_id
+        elif auth.issuer_type not in ("Business", "App"):
+            raise BaseHTTPException(401, "unauthorized", "Unauthorized")
+
+        try:
+            export_fields = parse_export_fields(fields)
+        except ValueError as e:
+            raise BaseHTTPException(400, "invalid_fields", str(e))
 
+        lines = export_payments(
+            format,
+            export_fields,
+            business_name=auth.business.name,
+            user_id=user_id,
+            status=status,
+            created_at_from=created_at_from,
+            created_at_to=created_at_to,
+        )
+        return StreamingResponse(
+            lines,
+            media_type=MEDIA_TYPES[format],
+            headers={
+                "Content-Disposition": f'attachment; filename="payments.{format}"'
+            },
+        )
+
+    async def retrieve_item(self, request: Request, uid: uuid.UUID):
+        auth = await self.get_auth(request)
+        item = await self.get_item(uid, business_name=auth.business.name)
+        wallets, options = await asyncio.gather(
+            partial_lookup(
+                "wallets",
+                (
+                    get_wallets(auth.business, auth.user_id)
+                    if auth.user_id
+                    else asyncio.sleep(0)
+                ),
+            ),
+            partial_lookup("ipgs", payments_options(item, business=auth.business)),
+        )
+        return document_response(item, ipgs=options, wallets=wallets)
+
+    async def build_payment(
+        self,
+        auth: AuthorizationData,
+        data: PaymentCreateSchema,
+        configuration: Configuration = None,
+        user_id: uuid.UUID = None,
+    ) -> Payment:
+        """Build an unsaved payment of the authorized business."""
         if not "currency" in data.model_fields_set:
             data.currency = auth.business.config.default_currency
 
         if not data.available_ipgs:
-            configuration: Configuration = await Configuration.get_config(
-                auth.business.name
-            )
+            if configuration is None:
+                configuration = await Configuration.get_config(auth.business.name)
+            if configuration is None:
+                raise BaseHTTPException(
+                    400, "no_configuration", "The business has no configuration"
+                )
             data.available_ipgs = configuration.ipgs
 
-        item = Payment(
-            business_name=auth.business.name,
-            user_id=auth.user_id,
-            **data.model_dump(exclude=["user_id"]),
+        return Payment.from_create_schema(
+            data, business_name=auth.business.name, user_id=user_id or auth.user_id
         )
-        await item.save()
-        return item
+
+    async def create_item(self, request: Request, data: PaymentCreateSchema):
+        auth = await self.get_auth(request)
+        item = await self.build_payment(auth, data)
+        await item.insert()
+        return document_response(item, status_code=201)
 
         # return await super().create_item(request, item.model_dump())
 
+    async def create_items_bulk(self, request: Request, data: PaymentBulkCreateSchema):
+        """Create a batch of payments with one unordered insert.
+
+        Items are validated one by one; invalid or rejected items are reported
+        in the results without failing the rest of the batch.
+        """
+        auth = await self.get_auth(request)
+        configuration = await Configuration.get_config(auth.business.name)
+
+        results: list[PaymentBulkResultSchema] = []
+        # (index in results, payment) of the payments to insert
+        payments: list[tuple[int, Payment]] = []
+        for index, item_data in enumerate(data.items):
+            # users only create their own payments, businesses and apps
+            # create them on behalf of the user given in each item
+            if auth.issuer_type == "User":
+                item_data = {**item_data, "user_id": auth.user_id}
+            try:
+                item_schema = PaymentCreateSchema.model_validate(item_data)
+                payment = await self.build_payment(
+                    auth, item_schema, configuration, user_id=item_schema.user_id
+                )
+            except ValidationError as e:
+                results.append(PaymentBulkResultSchema(index=index, error=str(e)))
+                continue
+            except BaseHTTPException as e:
+                results.append(PaymentBulkResultSchema(index=index, error=e.detail))
+                continue
+            results.append(PaymentBulkResultSchema(index=index, uid=payment.uid))
+            payments.append((index, payment))
+
+        if payments:
+            try:
+                await Payment.insert_many(
+                    [payment for _, payment in payments], ordered=False
+                )
+            except BulkWriteError as e:
+                for write_error in e.details.get("writeErrors", []):
+                    result = results[payments[write_error["index"]][0]]
+                    result.uid = None
+                    result.error = write_error.get("errmsg")
+
+        created = sum(1 for result in results if result.error is None)
+        return PaymentBulkResponseSchema(
+            created=created, failed=len(results) - created, results=results
+        )
+
     async def update_item(
         self, request: Request, uid: uuid.UUID, data: PaymentUpdateSchema
     ):
@@ -111,9 +324,18 @@ class PaymentRouter(AbstractAuthRouter[Payment, PaymentSchema]):
         callback_url: str,
         test: bool = False,
     ):
-        payment: Payment = await self.create_item(
-            request,
+        auth = await self.get_auth(request)
+        if not auth.user_id:
+            raise BaseHTTPException(401, "unauthorized", "Unauthorized")
+
+        logging.info(
+            f"start_direct_payment: {wallet_id=}, {amount=}, {description=}, {callback_url=}, {test=}"
+        )
+        # built in memory and inserted once together with its first try
+        payment = await self.build_payment(
+            auth,
             PaymentCreateSchema(
+                user_id=auth.user_id,
                 wallet_id=wallet_id,
                 amount=amount,
                 description=description,
@@ -121,10 +343,27 @@ class PaymentRouter(AbstractAuthRouter[Payment, PaymentSchema]):
                 is_test=test,
             ),
         )
-        logging.info(
-            f"start_direct_payment: {wallet_id=}, {amount=}, {description=}, {callback_url=}, {test=}"
+        if payment.amount and not payment.available_ipgs:
+            raise BaseHTTPException(400, "no_ipg", "No ipg is available")
+        start_data = await start_new_payment(
+            payment=payment,
+            business=auth.business,
+            ipg=payment.available_ipgs[0] if payment.available_ipgs else None,
+            user_id=auth.user_id,
+            phone=auth.user.phone if auth.user else None,
+        )
+        return self.start_response(request, start_data)
+
+    def start_response(self, request: Request, start_data: dict):
+        if start_data["status"]:
+            if request.method == "GET":
+                return RedirectResponse(url=start_data["url"])
+            else:
+                return {"redirect_url": start_data["url"]}
+
+        raise BaseHTTPException(
+            status_code=start_data.pop("status_code", 400), **start_data
         )
-        return await self.start_payment(request, payment.uid)
 
     async def start_payment(
         self, request: Request, uid: uuid.UUID, ipg: str = None, amount: Decimal = None
@@ -145,14 +384,7 @@ class PaymentRouter(AbstractAuthRouter[Payment, PaymentSchema]):
             user_id=auth.user_id,
             phone=auth.user.phone if auth.user else None,
         )
-
-        if start_data["status"]:
-            if request.method == "GET":
-                return RedirectResponse(url=start_data["url"])
-            else:
-                return {"redirect_url": start_data["url"]}
-
-        raise BaseHTTPException(status_code=400, **start_data)
+        return self.start_response(request, start_data)
 
     from pydantic import BaseModel
 
@@ -172,24 +404,29 @@ class PaymentRouter(AbstractAuthRouter[Payment, PaymentSchema]):
         business = await get_business(request)
 
         item: Payment = await self.get_item(uid, business_name=business.name)
-        payment_status = item.status
 
+        # the core proposal of a successful payment is recorded in the outbox
+        # by the same write and sent by the outbox workers
         payment: Payment = await verify_payment(business=business, payment=item)
 
         payment_redirect_url = (
             f"{payment.callback_url}?payment_id={payment.uid}&status={payment.status.value}"
         )
-        if payment.status == PaymentStatus.PENDING:
-            return RedirectResponse(url=payment_redirect_url, status_code=303)
-            # return proper response
-            return payment
-        if payment.status == PaymentStatus.SUCCESS:
-            if payment_status == PaymentStatus.PENDING:
-                await create_proposal(payment)
-            else:
-                logging.info(f"payment was not pending {payment_status=}")
-
         return RedirectResponse(url=payment_redirect_url, status_code=303)
 
+    async def purchase_callback(self, request: Request):
+        """Apply a purchase status pushed by an ipg, see `callbacks.py`."""
+        # the signature covers the raw body, so it is parsed here
+        body = await request.body()
+        await authorize_callback(request, body)
+        try:
+            data = PurchaseCallbackSchema.model_validate_json(body)
+        except ValidationError as e:
+            raise BaseHTTPException(422, "invalid_callback", str(e))
+
+        business = await get_business(request)
+        payment = await apply_purchase_callback(business, data)
+        return PurchaseCallbackResponseSchema(uid=payment.uid, status=payment.status)
+
 
 router = PaymentRouter().router
@@ -4,11 +4,17 @@ from decimal import Decimal
 from enum import Enum
 from typing import Any, Literal
 
-from fastapi_mongo_base.schemas import BaseEntitySchema, BusinessOwnedEntitySchema
+from fastapi_mongo_base.schemas import (
+    BaseEntitySchema,
+    BusinessOwnedEntitySchema,
+    PaginatedResponse,
+)
 from fastapi_mongo_base.utils import bsontools, texttools
 from pydantic import BaseModel, Field, field_validator, model_validator
 from ufaas_fastapi_business.core.enums import Currency
 
+from server.config import Settings
+
 
 class ExtensionSchema(BaseEntitySchema):
     name: str
@@ -36,6 +42,24 @@ class PurchaseStatus(str, Enum):
 PaymentStatus = PurchaseStatus
 
 
+class ProposalStatus(str, Enum):
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
+class ProposalOutboxSchema(BaseModel):
+    """Core proposal of a successful payment, waiting to be sent by the workers."""
+
+    status: ProposalStatus = ProposalStatus.PENDING
+    idempotency_key: uuid.UUID = Field(default_factory=uuid.uuid4)
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.now)
+    locked_until: datetime | None = None
+    last_error: str | None = None
+
+
 class PurchaseSchema(BaseEntitySchema):
     ipg: str
     user_id: uuid.UUID | None = None
@@ -95,6 +119,38 @@ class PaymentCreateSchema(BaseModel):
         return value
 
 
+class PurchaseCallbackSchema(BaseModel):
+    # purchase status pushed by an ipg, see callbacks.py
+    uid: uuid.UUID
+    status: PurchaseStatus
+    ipg: str | None = None
+
+
+class PurchaseCallbackResponseSchema(BaseModel):
+    # the payment of the purchase
+    uid: uuid.UUID
+    status: PaymentStatus
+
+
+class PaymentBulkCreateSchema(BaseModel):
+    # raw items, validated one by one so a bad item does not reject the batch
+    items: list[dict[str, Any]] = Field(
+        min_length=1, max_length=Settings.bulk_max_items
+    )
+
+
+class PaymentBulkResultSchema(BaseModel):
+    index: int
+    uid: uuid.UUID | None = None
+    error: str | None = None
+
+
+class PaymentBulkResponseSchema(BaseModel):
+    created: int
+    failed: int
+    results: list[PaymentBulkResultSchema]
+
+
 class PaymentUpdateSchema(BaseModel):
     voucher_code: str | None = None
 
@@ -105,13 +161,15 @@ class PaymentSchema(PaymentCreateSchema, BusinessOwnedEntitySchema):
     status: PaymentStatus = PaymentStatus.INIT
     tries: list[PurchaseSchema] = []
     verified_at: datetime | None = None
+    ref_id: int | None = None
+    failure_reason: str | None = None
 
     original_amount: Decimal = 0
 
     duration: int = 60 * 60  # in seconds
 
     def is_overdue(self):
-        return self.created_at + timedelta(self.duration) < datetime.now()
+        return self.created_at + timedelta(seconds=self.duration) < datetime.now()
 
     @field_validator("amount", mode="before")
     def validate_amount(cls, value):
@@ -128,6 +186,12 @@ class PaymentSchema(PaymentCreateSchema, BusinessOwnedEntitySchema):
         return values
 
 
+class PaymentListSchema(PaginatedResponse[PaymentSchema]):
+    # total is skipped when paging by cursor, counting costs a full scan
+    total: int | None = None
+    next_cursor: str | None = None
+
+
 class PaymentRetrieveSchema(PaymentSchema):
     ipgs: list[ExtensionSchema] | None = None
     wallets: list[WalletSchema] | WalletSchema | None = None
@@ -1,19 +1,25 @@
-import re
+import asyncio
 import logging
+import re
 import uuid
 from decimal import Decimal
 from urllib.parse import urlparse
 from fastapi_mongo_base.core.exceptions import BaseHTTPException
-from fastapi_mongo_base.utils import aionetwork
 from ufaas_fastapi_business.models import Business
 
 from apps.config.models import Configuration
 from server.config import Settings
+from utils import httpclient
+from utils.access_token import get_access_token
+from utils.business import get_business_by_name
+from utils.cache import TTLCache
+from utils.resilience import UpstreamUnavailable
 
 from .models import Payment
 from .schemas import (
     ExtensionSchema,
     IPGPurchaseSchema,
+    PaymentStatus,
     ProposalCreateSchema,
     PurchaseSchema,
     PurchaseStatus,
@@ -25,16 +31,46 @@ def purchase_business_url(business: Business, ipg: str) -> str:
     return f"{business.config.api_os_url}/{ipg}/purchases/"
 
 
-async def payments_options(payment: Payment) -> list[ExtensionSchema]:
-    business = await Business.get_by_name(payment.business_name)
-    available_ipgs_paged = await aionetwork.aio_request(
-        url=f"{business.config.api_os_url}/installeds/",
-        params={"type": "ipg", "limit": 100},
-        headers={"Authorization": f"Bearer {await business.get_access_token()}"},
+installed_ipgs_cache = TTLCache(
+    ttl=Settings.ipg_cache_ttl,
+    stale_ttl=Settings.ipg_cache_stale_ttl,
+    name="installeds",
+)
+
+
+async def get_installed_ipgs(business: Business) -> list[dict]:
+    async def load_installed_ipgs() -> list[dict]:
+        available_ipgs_paged = await httpclient.aio_request(
+            url=f"{business.config.api_os_url}/installeds/",
+            upstream="installeds",
+            hedge=True,
+            params={"type": "ipg", "limit": 100},
+            headers={"Authorization": f"Bearer {await get_access_token(business)}"},
+        )
+        return available_ipgs_paged.get("items", [])
+
+    return await installed_ipgs_cache.get_or_load(business.name, load_installed_ipgs)
+
+
+def ipg_supports_currency(ipg: dict, currency: str) -> bool:
+    currencies = ipg.get("currencies") or (ipg.get("meta_data") or {}).get(
+        "currencies"
     )
-    # available_ipgs_paged: dict = response.json()
-    available_ipgs: list[dict] = available_ipgs_paged.get("items", [])
-    # TODO filter by currency
+    # ipgs that do not advertise their currencies are assumed to accept any
+    if not currencies:
+        return True
+    return currency in currencies
+
+
+async def payments_options(
+    payment: Payment, business: Business = None
+) -> list[ExtensionSchema]:
+    if business is None:
+        business = await get_business_by_name(payment.business_name)
+    available_ipgs = await get_installed_ipgs(business)
+    available_ipgs = [
+        ipg for ipg in available_ipgs if ipg_supports_currency(ipg, payment.currency)
+    ]
 
     if payment.available_ipgs:
         available_ipgs = [
@@ -45,10 +81,12 @@ async def payments_options(payment: Payment) -> list[ExtensionSchema]:
 
 async def get_wallets(business: Business, user_id: uuid.UUID) -> list[WalletSchema]:
     logging.info(f"{business.name=}, {business.config.core_url}")
-    wallets = await aionetwork.aio_request(
+    wallets = await httpclient.aio_request(
         url=f"{business.config.core_url}api/v1/wallets/",
+        upstream="wallets",
+        hedge=True,
         params={"user_id": str(user_id), "limit": 100},
-        headers={"Authorization": f"Bearer {await business.get_access_token()}"},
+        headers={"Authorization": f"Bearer {await get_access_token(business)}"},
     )
 
     return (
@@ -56,6 +94,54 @@ async def get_wallets(business: Business, user_id: uuid.UUID) -> list[WalletSche
     )
 
 
+def payment_callback_url(business: Business, payment: Payment) -> str:
+    return (
+        f"https://{business.domain}{Settings.base_path}/payments/{payment.uid}/verify"
+    )
+
+
+async def request_purchase(
+    payment: Payment,
+    business: Business,
+    ipg: str,
+    *,
+    amount: Decimal,
+    user_id: uuid.UUID = None,
+    phone: str = None,
+) -> PurchaseSchema:
+    headers = {"Authorization": f"Bearer {await get_access_token(business)}"}
+    ipg_schema = IPGPurchaseSchema(
+        user_id=user_id,
+        wallet_id=payment.wallet_id,
+        amount=amount,
+        description=payment.description,
+        callback_url=payment_callback_url(business, payment),
+        phone=phone,
+    )
+    logging.info(f"{ipg_schema=}")
+    response = await httpclient.aio_request(
+        method="post",
+        url=purchase_business_url(business, ipg),
+        upstream="purchases",
+        ipg=ipg,
+        json=ipg_schema.model_dump(mode="json"),
+        headers=headers,
+    )
+    purchase = PurchaseSchema(uid=response.get("uid"), ipg=ipg, user_id=user_id)
+    logging.info(f"{purchase=}")
+    return purchase
+
+
+def ipg_unavailable(ipg: str, error: UpstreamUnavailable) -> dict:
+    logging.warning(f"start payment on {ipg}: {error}")
+    return {
+        "status": False,
+        "message": f"{ipg} is unavailable, try again later or use another ipg",
+        "error": "ipg_unavailable",
+        "status_code": 503,
+    }
+
+
 async def start_payment(
     payment: Payment,
     business: Business,
@@ -84,35 +170,62 @@ async def start_payment(
             "error": "invalid_payment",
         }
 
-    callback_url = (
-        f"https://{business.domain}{Settings.base_path}/payments/{payment.uid}/verify"
-    )
-
     if amount == 0:
-        return {"status": True, "uid": payment.uid, "url": callback_url}
+        return {
+            "status": True,
+            "uid": payment.uid,
+            "url": payment_callback_url(business, payment),
+        }
 
-    headers = {"Authorization": f"Bearer {await business.get_access_token()}"}
-    ipg_schema = IPGPurchaseSchema(
-        user_id=user_id,
-        wallet_id=payment.wallet_id,
-        amount=amount,
-        description=payment.description,
-        callback_url=callback_url,
-        phone=phone,
-    )
-    logging.info(f"{ipg_schema=}")
-    response = await aionetwork.aio_request(
-        method="post",
-        url=purchase_business_url(business, ipg),
-        json=ipg_schema.model_dump(mode="json"),
-        headers=headers,
-        timeout=10,
-    )
-    purchase = PurchaseSchema(uid=response.get("uid"), ipg=ipg, user_id=user_id)
+    try:
+        purchase = await request_purchase(
+            payment, business, ipg, amount=amount, user_id=user_id, phone=phone
+        )
+    except UpstreamUnavailable as e:
+        return ipg_unavailable(ipg, e)
+    if not await payment.add_try(purchase):
+        return {
+            "status": False,
+            "message": f"Payment was {payment.status}",
+            "error": "invalid_payment",
+        }
+    return {
+        "status": True,
+        "uid": payment.uid,
+        "url": f"{purchase_business_url(business, ipg)}{purchase.uid}/start/",
+    }
+
+
+async def start_new_payment(
+    payment: Payment,
+    business: Business,
+    ipg: str,
+    *,
+    user_id: uuid.UUID = None,
+    phone: str = None,
+) -> dict:
+    """Start a payment that is not saved yet and insert it with its first try.
+
+    The purchase is requested before the payment exists in the database, so
+    starting costs a single write instead of a save, a re-read and an update.
+    """
+    if payment.amount == 0:
+        await payment.insert()
+        return {
+            "status": True,
+            "uid": payment.uid,
+            "url": payment_callback_url(business, payment),
+        }
+
+    try:
+        purchase = await request_purchase(
+            payment, business, ipg, amount=payment.amount, user_id=user_id, phone=phone
+        )
+    except UpstreamUnavailable as e:
+        return ipg_unavailable(ipg, e)
     payment.tries.append(purchase)
-    payment.status = PurchaseStatus.PENDING
-    await payment.save()
-    logging.info(f"{purchase=}")
+    payment.status = PaymentStatus.PENDING
+    await payment.insert()
     return {
         "status": True,
         "uid": payment.uid,
@@ -120,39 +233,68 @@ async def start_payment(
     }
 
 
-async def verify_payment(business: Business, payment: Payment, **kwargs) -> Payment:
-    # if payment.status in ["SUCCESS", "FAILED"]:
-    #     return payment
+async def get_purchase(business: Business, ipg: str, uid: str, headers: dict):
+    url = f"{purchase_business_url(business, ipg)}{uid}"
+    response = await httpclient.aio_request(
+        url=url, upstream="purchases", ipg=ipg, headers=headers, hedge=True
+    )
+    purchase = PurchaseSchema(**response, ipg=ipg)
+    logging.info(f"verify_payment\n{url=}\n{purchase=}\n\n")
+    return purchase
+
 
+async def verify_payment(
+    business: Business,
+    payment: Payment,
+    ipg_semaphores: dict[str, asyncio.Semaphore] = None,
+    **kwargs,
+) -> Payment:
+    """Poll the open tries of a payment and persist their outcome.
+
+    `ipg_semaphores` bounds the polls per ipg when several payments are
+    verified together, otherwise each verify bounds its own polls.
+    """
+    # nothing can change a successful or refunded payment; failed ones are
+    # still polled since a late success of an open try overrides an expiry
+    if payment.status in (PaymentStatus.SUCCESS, PaymentStatus.REFUNDED):
+        return payment
+
+    statuses = {}
     if payment.amount == 0:
-        await payment.success_purchase(None)
-
-    for try_ in payment.tries:
-        if try_.status.is_open():
-            url = f"{purchase_business_url(business, try_.ipg)}{try_.uid}"
-
-            response = await aionetwork.aio_request(
-                url=url,
-                headers={
-                    "Authorization": f"Bearer {await business.get_access_token()}",
-                    "Accept-Encoding": "identity",
-                },
-            )
-            purchase = PurchaseSchema(**response, ipg=try_.ipg)
-            logging.info(f"verify_payment\n{url=}\n{purchase=}\n{try_=}\n\n")
-            if purchase.status.is_open():
-                continue
-            if purchase.status == "SUCCESS":
-                await payment.success_purchase(purchase.uid)
+        statuses[None] = PurchaseStatus.SUCCESS
+
+    open_tries = [try_ for try_ in payment.tries if try_.status.is_open()]
+    if open_tries:
+        headers = {
+            "Authorization": f"Bearer {await get_access_token(business)}",
+            "Accept-Encoding": "identity",
+        }
+        if ipg_semaphores is None:
+            semaphore = asyncio.Semaphore(Settings.verify_concurrency)
+            ipg_semaphores = {try_.ipg: semaphore for try_ in open_tries}
+
+        async def poll(try_: PurchaseSchema):
+            async with ipg_semaphores[try_.ipg]:
+                return await get_purchase(business, try_.ipg, try_.uid, headers)
+
+        purchases = await asyncio.gather(
+            *[poll(try_) for try_ in open_tries], return_exceptions=True
+        )
+        for try_, purchase in zip(open_tries, purchases):
+            if isinstance(purchase, Exception):
+                logging.error(f"verify_payment {try_.ipg} {try_.uid}: {purchase}")
                 continue
-            elif purchase.status == "FAILED":
-                await payment.fail_purchase(purchase.uid)
+            if purchase.status.is_open():
                 continue
+            if purchase.status in (PurchaseStatus.SUCCESS, PurchaseStatus.FAILED):
+                statuses[purchase.uid] = purchase.status
 
+    if statuses:
+        await payment.apply_purchase_statuses(statuses)
     return payment
 
 
-async def create_proposal(payment: Payment) -> dict:
+async def create_proposal(payment: Payment, idempotency_key: uuid.UUID = None) -> dict:
     business = await payment.get_business()
     # business.config
     config: Configuration = await Configuration.get_config(business.name)
@@ -202,24 +344,32 @@ async def create_proposal(payment: Payment) -> dict:
         meta_data=None,
     ).model_dump_json()
 
-    access_token = await business.get_access_token()
+    access_token = await get_access_token(business)
     headers = {
         "Authorization": f"Bearer {access_token}",
         "content-type": "application/json",
     }
+    if idempotency_key:
+        headers["Idempotency-Key"] = str(idempotency_key)
 
-    response = await aionetwork.aio_request(
+    response = await httpclient.aio_request(
         method="post",
         url=business.config.core_url,
+        upstream="proposal",
         data=proposal_data,
         headers=headers,
         raise_exception=False,
     )
     if "error" in response:
         logging.error(f"Error in create_proposal {response}")
-        # raise PayPingException(f"Error in create_proposal {response}")
+        raise BaseHTTPException(
+            status_code=502,
+            error="proposal_failed",
+            message=f"Error in create_proposal {response}",
+        )
     return response
 
+
 regex = re.compile(
     r"^(https?|ftp):\/\/"  # http:// or https:// or ftp://
     r"(?"
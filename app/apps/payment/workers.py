@@ -0,0 +1,147 @@
+"""Background workers of the payment app."""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from ufaas_fastapi_business.models import Business
+
+from server.config import Settings
+from utils.business import get_business_by_name
+from utils.lease import acquire_lease
+
+from .models import Payment
+from .services import create_proposal, verify_payment
+
+
+def proposal_retry_at(attempts: int) -> datetime | None:
+    """Next attempt of a failed proposal with exponential backoff, or None."""
+    if attempts >= Settings.outbox_max_attempts:
+        return None
+    delay = min(
+        Settings.outbox_backoff_base * 2 ** (attempts - 1), Settings.outbox_backoff_max
+    )
+    return datetime.now() + timedelta(seconds=delay)
+
+
+async def process_proposal_outbox() -> bool:
+    """Send one due outbox proposal to the core. Returns whether one was found."""
+    payment = await Payment.claim_proposal(lease=Settings.outbox_lease)
+    if payment is None:
+        return False
+
+    try:
+        await create_proposal(payment, idempotency_key=payment.proposal.idempotency_key)
+    except Exception as e:
+        retry_at = proposal_retry_at(payment.proposal.attempts)
+        logging.error(
+            f"proposal of payment {payment.uid} failed "
+            f"(attempt {payment.proposal.attempts}, retry at {retry_at}): {e}"
+        )
+        await payment.release_proposal(
+            error=str(e) or type(e).__name__, next_attempt_at=retry_at
+        )
+    else:
+        await payment.release_proposal()
+    return True
+
+
+async def proposal_outbox_worker():
+    while True:
+        try:
+            if await process_proposal_outbox():
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"proposal outbox worker: {e}")
+        await asyncio.sleep(Settings.outbox_poll_interval)
+
+
+async def reconcile_page(
+    payments: list[Payment], ipg_semaphores: dict[str, asyncio.Semaphore]
+) -> int:
+    businesses: dict[str, Business] = {}
+    for name in {payment.business_name for payment in payments}:
+        businesses[name] = await get_business_by_name(name)
+
+    results = await asyncio.gather(
+        *[
+            verify_payment(
+                business=businesses[payment.business_name],
+                payment=payment,
+                ipg_semaphores=ipg_semaphores,
+            )
+            for payment in payments
+            if businesses[payment.business_name]
+        ],
+        return_exceptions=True,
+    )
+    verified = 0
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error(f"reconcile pending payment: {result}")
+        else:
+            verified += 1
+    return verified
+
+
+async def reconcile_pending_payments() -> int:
+    """Poll the open tries of pending and recently expired payments, page by page.
+
+    Polls are bounded per ipg across the whole page, so one slow gateway only
+    holds back its own payments. Returns how many payments were verified.
+    """
+    ipg_semaphores = defaultdict(
+        lambda: asyncio.Semaphore(Settings.reconcile_ipg_concurrency)
+    )
+    created_before = datetime.now() - timedelta(seconds=Settings.reconcile_min_age)
+    verified = 0
+    for expired in (False, True):
+        after = None
+        while True:
+            payments = await Payment.list_pending(
+                expired=expired,
+                after=after,
+                created_before=created_before,
+                limit=Settings.reconcile_page_size,
+            )
+            if not payments:
+                break
+            after = (payments[-1].created_at, payments[-1].id)
+            verified += await reconcile_page(payments, ipg_semaphores)
+    return verified
+
+
+async def reconciliation_scheduler():
+    while True:
+        await asyncio.sleep(Settings.reconcile_interval)
+        try:
+            # every worker process runs a scheduler, only the lease holder sweeps
+            if not await acquire_lease("reconciliation", Settings.reconcile_lease):
+                continue
+            # poll before expiring, so payments paid at the last moment succeed
+            verified = await reconcile_pending_payments()
+            expired = await Payment.expire_overdue()
+            logging.info(f"reconciliation: {verified=} {expired=}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"reconciliation scheduler: {e}")
+
+
+def start_workers() -> list[asyncio.Task]:
+    tasks = [
+        asyncio.create_task(proposal_outbox_worker())
+        for _ in range(Settings.outbox_workers)
+    ]
+    if Settings.reconcile_interval > 0:
+        tasks.append(asyncio.create_task(reconciliation_scheduler()))
+    return tasks
+
+
+async def stop_workers(tasks: list[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,61 @@
+"""CPU cost of the schemas, validators and serialization on the request path."""
+
+from fastapi_mongo_base.utils import bsontools
+
+from apps.payment.export import jsonable
+from apps.payment.models import Payment
+from apps.payment.schemas import (
+    ExtensionSchema,
+    PaymentCreateSchema,
+    PaymentSchema,
+)
+from apps.payment.services import is_valid_url
+from utils.responses import document_response
+
+
+def bench_is_valid_url(benchmark, create_payload):
+    assert benchmark(is_valid_url, create_payload["callback_url"])
+
+
+def bench_decimal_amount(benchmark, stored_payment):
+    benchmark(bsontools.decimal_amount, stored_payment["amount"])
+
+
+def bench_create_schema_validate(benchmark, create_payload):
+    benchmark(PaymentCreateSchema.model_validate, create_payload)
+
+
+def bench_payment_schema_validate(benchmark, stored_payment):
+    benchmark(PaymentSchema.model_validate, stored_payment)
+
+
+def bench_payment_document_load(benchmark, stored_payment):
+    # what beanie does for every payment read from mongo
+    benchmark(Payment.model_validate, stored_payment)
+
+
+def bench_payment_document_create(benchmark, create_payload):
+    data = PaymentCreateSchema.model_validate(create_payload)
+    benchmark(
+        Payment.from_create_schema, data, business_name="bench", user_id=data.user_id
+    )
+
+
+def bench_payment_model_dump(benchmark, payment):
+    benchmark(payment.model_dump)
+
+
+def bench_payment_model_dump_json(benchmark, payment):
+    benchmark(payment.model_dump_json)
+
+
+def bench_retrieve_response(benchmark, payment):
+    ipgs = [
+        ExtensionSchema(name=name, domain=f"{name}.example.com", type="ipg")
+        for name in payment.available_ipgs
+    ]
+    benchmark(document_response, payment, ipgs=ipgs, wallets=None)
+
+
+def bench_export_row(benchmark, stored_payment):
+    benchmark(jsonable, stored_payment)
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from beanie import init_beanie
+from bson import Decimal128
+from mongomock_motor import AsyncMongoMockClient
+
+from apps.config.models import Configuration
+from apps.payment.models import Payment
+
+
+@pytest.fixture(scope="session", autouse=True)
+def db():
+    # documents can only be built once beanie knows their collection
+    database = AsyncMongoMockClient().get_database("bench_db")
+    asyncio.run(
+        init_beanie(database=database, document_models=[Payment, Configuration])
+    )
+
+
+@pytest.fixture(scope="session")
+def create_payload() -> dict:
+    return {
+        "user_id": str(uuid.uuid4()),
+        "wallet_id": str(uuid.uuid4()),
+        "amount": "125000",
+        "description": "order 1024",
+        "callback_url": "https://shop.example.com/orders/1024/callback",
+        "available_ipgs": ["zarinpal", "saman"],
+    }
+
+
+@pytest.fixture(scope="session")
+def stored_payment(create_payload: dict) -> dict:
+    """A payment with two tries as it is read back from mongo."""
+    now = datetime.now()
+    tries = [
+        {
+            "uid": uuid.uuid4(),
+            "ipg": ipg,
+            "user_id": uuid.UUID(create_payload["user_id"]),
+            "status": status,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for ipg, status in (("zarinpal", "FAILED"), ("saman", "SUCCESS"))
+    ]
+    return {
+        **create_payload,
+        "uid": uuid.uuid4(),
+        "business_name": "bench",
+        "user_id": uuid.UUID(create_payload["user_id"]),
+        "wallet_id": uuid.UUID(create_payload["wallet_id"]),
+        "amount": Decimal128(Decimal(create_payload["amount"])),
+        "original_amount": Decimal128(Decimal(create_payload["amount"])),
+        "currency": "IRR",
+        "status": "SUCCESS",
+        "tries": tries,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+@pytest.fixture(scope="session")
+def payment(stored_payment: dict) -> Payment:
+    return Payment.model_validate(stored_payment)
@@ -0,0 +1,361 @@
+"""Load test of the payment flow against local upstream stand-ins.
+
+Starts the stub upstreams and the cashier app on local ports, then drives
+create -> start -> verify -> retrieve flows at a target rate and prints the
+throughput and latency percentiles of each endpoint as JSON.
+
+    cd app && python -m benchmarks.loadtest --rps 50 --duration 30
+    python -m benchmarks.loadtest --mongo-uri mongodb://localhost:27017/ \
+        --latency 80 --latency-for purchases=250 --output bench.json
+
+Without `--mongo-uri` the app runs on mongomock, which is good for comparing
+the app's own overhead between releases but not the database.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from .stubs import IPG_NAME, UPSTREAMS, StubUpstreams, wallet_id_for
+
+STEPS = ("create", "start", "verify", "retrieve")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except Exception:
+        return None
+
+
+class ServerThread(threading.Thread):
+    """Run an ASGI app with uvicorn on its own event loop and thread."""
+
+    def __init__(self, app, port: int):
+        import uvicorn
+
+        super().__init__(daemon=True)
+        self.server = uvicorn.Server(
+            uvicorn.Config(
+                app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"
+            )
+        )
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.server.serve())
+
+    def start(self, timeout: float = 30):
+        super().start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("server did not start")
+            time.sleep(0.05)
+
+    def call(self, coro, timeout: float = 30):
+        """Run a coroutine on the server's loop, e.g. to seed its database."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.join(timeout=30)
+
+
+def configure_environment(stubs: StubUpstreams, args):
+    # read by the settings on import, so set before the app is imported
+    os.environ["UFAAS_BUSINESS_DOMAINS_URL"] = stubs.business_domains_url
+    os.environ["USSO_JWT_CONFIG"] = json.dumps({"jwk_url": stubs.jwks_url})
+    os.environ["CORE_URL"] = f"{stubs.base_url}/"
+    os.environ["API_OS_URL"] = f"{stubs.base_url}/api/v1/apps"
+    os.environ["SSO_URL"] = f"{stubs.base_url}/"
+    os.environ["CORE_SSO_URL"] = f"{stubs.base_url}/app-auth/access"
+    os.environ.setdefault("APP_ID", "bench")
+    os.environ.setdefault("APP_SECRET", "bench-secret")
+    os.environ.setdefault("PROJECT_NAME", "cashier-bench")
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        # neither $indexStats nor change streams exist on mongomock
+        os.environ["CHECK_INDEXES"] = "false"
+        os.environ["CONFIG_CHANGE_STREAM"] = "false"
+
+
+def use_mongomock():
+    from fastapi_mongo_base.core import db
+    from mongomock_motor import AsyncMongoMockClient
+
+    db.AsyncIOMotorClient = AsyncMongoMockClient
+
+
+async def seed_configuration():
+    from apps.config.models import Configuration
+
+    from .stubs import BUSINESS_NAME
+
+    await Configuration.find({"business_name": BUSINESS_NAME}).delete()
+    await Configuration(
+        business_name=BUSINESS_NAME, wallet_id=uuid.uuid4(), ipgs=[IPG_NAME]
+    ).insert()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.flows = {"started": 0, "completed": 0, "failed": 0, "dropped": 0}
+
+    async def request(
+        self, step: str, client: httpx.AsyncClient, method: str, url: str, ok, **kwargs
+    ) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.errors[step] += 1
+            logging.warning(f"{step}: {e!r}")
+            return None
+        self.latencies[step].append(time.perf_counter() - start)
+        self.statuses[step][response.status_code] += 1
+        if response.status_code not in ok:
+            self.errors[step] += 1
+            logging.warning(f"{step}: {response.status_code} {response.text[:200]}")
+            return None
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for step in STEPS:
+            latencies = sorted(self.latencies[step])
+            summary = {
+                "count": len(latencies),
+                "errors": self.errors[step],
+                "statuses": dict(self.statuses[step]),
+                "rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+            }
+            if latencies:
+                if len(latencies) > 1:
+                    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+                    p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+                else:
+                    p50 = p95 = p99 = latencies[0]
+                summary.update(
+                    {
+                        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+                        "p50_ms": round(p50 * 1000, 2),
+                        "p95_ms": round(p95 * 1000, 2),
+                        "p99_ms": round(p99 * 1000, 2),
+                        "max_ms": round(latencies[-1] * 1000, 2),
+                    }
+                )
+            endpoints[step] = summary
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "flows": dict(self.flows),
+            "flows_per_s": (
+                round(self.flows["completed"] / elapsed, 2) if elapsed else 0
+            ),
+            "endpoints": endpoints,
+        }
+
+
+async def payment_flow(
+    client: httpx.AsyncClient, stubs: StubUpstreams, recorder: Recorder
+) -> bool:
+    user_id = uuid.uuid4()
+    headers = {"Authorization": f"Bearer {stubs.make_token(user_id)}"}
+
+    response = await recorder.request(
+        "create",
+        client,
+        "POST",
+        "/payments/",
+        (200, 201),
+        headers=headers,
+        json={
+            "user_id": str(user_id),
+            "wallet_id": str(wallet_id_for(user_id)),
+            "amount": 1000,
+            "description": "load test",
+            "callback_url": "https://bench.local/callback",
+        },
+    )
+    if response is None:
+        return False
+    uid = response.json()["uid"]
+
+    steps = (
+        ("start", f"/payments/{uid}/start", {"ipg": IPG_NAME}, (302, 307)),
+        ("verify", f"/payments/{uid}/verify", None, (303,)),
+        ("retrieve", f"/payments/{uid}", None, (200,)),
+    )
+    for step, url, params, ok in steps:
+        if (
+            await recorder.request(
+                step, client, "GET", url, ok, headers=headers, params=params
+            )
+            is None
+        ):
+            return False
+    return True
+
+
+async def drive(base_url: str, stubs: StubUpstreams, args) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(
+        max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight
+    )
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=args.timeout
+    ) as client:
+
+        async def run_flow(record: bool):
+            try:
+                completed = await payment_flow(
+                    client, stubs, recorder if record else Recorder()
+                )
+            finally:
+                in_flight.release()
+            if record:
+                recorder.flows["completed" if completed else "failed"] += 1
+
+        async def run(duration: float, record: bool):
+            # open loop: flows start on schedule whether or not earlier ones finished
+            tasks = []
+            interval = 1 / args.rps
+            start = time.perf_counter()
+            next_at = start
+            while next_at - start < duration:
+                await asyncio.sleep(max(0, next_at - time.perf_counter()))
+                next_at += interval
+                if in_flight.locked():
+                    if record:
+                        recorder.flows["dropped"] += 1
+                    continue
+                await in_flight.acquire()
+                if record:
+                    recorder.flows["started"] += 1
+                tasks.append(asyncio.create_task(run_flow(record)))
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - start
+
+        if args.warmup:
+            await run(args.warmup, record=False)
+        elapsed = await run(args.duration, record=True)
+
+    return recorder.report(elapsed)
+
+
+def parse_latencies(values: list[str]) -> dict[str, float]:
+    latencies = {}
+    for value in values or []:
+        upstream, _, ms = value.partition("=")
+        if upstream not in UPSTREAMS:
+            raise argparse.ArgumentTypeError(
+                f"unknown upstream {upstream!r}, expected one of {', '.join(UPSTREAMS)}"
+            )
+        latencies[upstream] = float(ms) / 1000
+    return latencies
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rps", type=float, default=20, help="payment flows per second"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds, not reported")
+    parser.add_argument("--max-in-flight", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--latency", type=float, default=50, help="upstream ms")
+    parser.add_argument("--jitter", type=float, default=10, help="upstream ms")
+    parser.add_argument(
+        "--latency-for",
+        action="append",
+        metavar="UPSTREAM=MS",
+        help=f"per upstream latency, one of {', '.join(UPSTREAMS)}",
+    )
+    parser.add_argument("--success-ratio", type=float, default=1.0)
+    parser.add_argument("--mongo-uri", help="local mongod, mongomock when omitted")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    stub_port, app_port = free_port(), free_port()
+    stubs = StubUpstreams(
+        f"http://127.0.0.1:{stub_port}",
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        latencies=parse_latencies(args.latency_for),
+        success_ratio=args.success_ratio,
+    )
+    configure_environment(stubs, args)
+    if not args.mongo_uri:
+        use_mongomock()
+
+    from server.config import Settings
+    from server.server import app
+
+    stub_server = ServerThread(stubs.app, stub_port)
+    app_server = ServerThread(app, app_port)
+    stub_server.start()
+    app_server.start()
+    try:
+        app_server.call(seed_configuration())
+        base_url = f"http://127.0.0.1:{app_port}{Settings.base_path}"
+        report = asyncio.run(drive(base_url, stubs, args))
+    finally:
+        app_server.stop()
+        stub_server.stop()
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "database": "mongodb" if args.mongo_uri else "mongomock",
+        "target_rps": args.rps,
+        "upstream_latency_ms": {
+            upstream: round(stubs.latencies.get(upstream, stubs.latency) * 1000, 2)
+            for upstream in UPSTREAMS
+        },
+        "upstream_requests": stubs.requests,
+        **report,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Local stand-ins for the upstreams of the cashier.
+
+One FastAPI app serves the business service, app auth, JWKS, installed ipgs,
+ipg purchases, core wallets and the core proposal endpoint, each with an
+injected latency.
+"""
+
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request
+
+BUSINESS_NAME = "bench"
+BUSINESS_DOMAIN = "bench.local"
+BUSINESS_USER_ID = uuid.UUID("00000000-0000-4000-8000-000000000001")
+IPG_NAME = "stub-ipg"
+KEY_ID = "bench"
+
+# upstream -> route names, used for latency overrides and the request counters
+UPSTREAMS = (
+    "business",
+    "sso",
+    "jwks",
+    "installeds",
+    "purchases",
+    "wallets",
+    "proposals",
+)
+
+
+def wallet_id_for(user_id: uuid.UUID | str) -> uuid.UUID:
+    """The single wallet the stub core reports for a user."""
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"wallet:{user_id}")
+
+
+class StubUpstreams:
+    def __init__(
+        self,
+        base_url: str,
+        latency: float = 0.05,
+        jitter: float = 0.01,
+        latencies: dict[str, float] = None,
+        success_ratio: float = 1.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.latency = latency
+        self.jitter = jitter
+        self.latencies = latencies or {}
+        self.success_ratio = success_ratio
+        self.purchases: dict[str, dict] = {}
+        self.requests = {upstream: 0 for upstream in UPSTREAMS}
+        self.private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048
+        )
+        self.app = self.create_app()
+
+    @property
+    def jwks_url(self) -> str:
+        return f"{self.base_url}/jwks.json"
+
+    @property
+    def business_domains_url(self) -> str:
+        return f"{self.base_url}/api/v1/apps/business"
+
+    def make_token(self, user_id: uuid.UUID | str, ttl: int = 3600, **claims) -> str:
+        payload = {
+            "user_id": str(user_id),
+            "token_type": "access",
+            "is_active": True,
+            "exp": int(time.time()) + ttl,
+            **claims,
+        }
+        return jwt.encode(
+            payload, self.private_key, algorithm="RS256", headers={"kid": KEY_ID}
+        )
+
+    def business(self) -> dict:
+        return {
+            "uid": str(uuid.uuid5(uuid.NAMESPACE_URL, BUSINESS_NAME)),
+            "user_id": str(BUSINESS_USER_ID),
+            "name": BUSINESS_NAME,
+            "domain": BUSINESS_DOMAIN,
+            "config": {
+                "core_url": f"{self.base_url}/",
+                "api_os_url": f"{self.base_url}/api/v1/apps",
+                "sso_url": f"{self.base_url}/",
+                "core_sso_url": f"{self.base_url}/app-auth/access",
+                "jwt_config": {"jwk_url": self.jwks_url},
+            },
+        }
+
+    async def delay(self, upstream: str):
+        self.requests[upstream] += 1
+        latency = self.latencies.get(upstream, self.latency)
+        if latency > 0:
+            await asyncio.sleep(max(0, random.gauss(latency, self.jitter)))
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+
+        @app.get("/api/v1/apps/business/businesses/")
+        async def businesses():
+            await self.delay("business")
+            return {"items": [self.business()], "total": 1, "offset": 0, "limit": 10}
+
+        @app.post("/app-auth/access")
+        async def app_auth():
+            await self.delay("sso")
+            return {"access_token": self.make_token(BUSINESS_USER_ID, ttl=600)}
+
+        @app.get("/jwks.json")
+        async def jwks():
+            await self.delay("jwks")
+            jwk = json.loads(
+                jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key())
+            )
+            jwk.update({"kid": KEY_ID, "use": "sig", "alg": "RS256"})
+            return {"keys": [jwk]}
+
+        @app.get("/api/v1/apps/installeds/")
+        async def installeds():
+            await self.delay("installeds")
+            ipg = {
+                "uid": str(uuid.uuid5(uuid.NAMESPACE_URL, IPG_NAME)),
+                "name": IPG_NAME,
+                "domain": f"{IPG_NAME}.local",
+                "type": "ipg",
+            }
+            return {"items": [ipg], "total": 1, "offset": 0, "limit": 100}
+
+        @app.post("/api/v1/apps/{ipg}/purchases/")
+        async def create_purchase(ipg: str, request: Request):
+            await self.delay("purchases")
+            data = await request.json()
+            uid = str(uuid.uuid4())
+            self.purchases[uid] = {
+                "uid": uid,
+                "user_id": data.get("user_id"),
+                "status": (
+                    "SUCCESS" if random.random() < self.success_ratio else "FAILED"
+                ),
+            }
+            return {"uid": uid, "status": "INIT"}
+
+        @app.get("/api/v1/apps/{ipg}/purchases/{uid}")
+        async def retrieve_purchase(ipg: str, uid: str):
+            await self.delay("purchases")
+            return self.purchases.get(uid, {"uid": uid, "status": "PENDING"})
+
+        @app.get("/api/v1/wallets/")
+        async def wallets(user_id: uuid.UUID):
+            await self.delay("wallets")
+            wallet = {
+                "uid": str(wallet_id_for(user_id)),
+                "user_id": str(user_id),
+                "business_name": BUSINESS_NAME,
+                "balance": {"IRR": 10**12},
+                "wallet_type": "user",
+                "main_currency": "IRR",
+            }
+            return {"items": [wallet], "total": 1, "offset": 0, "limit": 100}
+
+        @app.post("/")
+        async def proposals():
+            await self.delay("proposals")
+            return {"uid": str(uuid.uuid4()), "task_status": "init"}
+
+        return app
@@ -1,6 +1,7 @@
 """FastAPI server configuration."""
 
 import dataclasses
+import os
 from pathlib import Path
 
 import dotenv
@@ -16,3 +17,172 @@ class Settings(config.Settings):
     base_dir: Path = Path(__file__).resolve().parent.parent
     base_path: str = "/api/v1/apps/cashier"
     currency: str = "IRR"
+
+    # default upstreams of businesses that do not configure their own
+    core_url: str = os.getenv("CORE_URL", default="https://core.ufaas.io/")
+    api_os_url: str = os.getenv(
+        "API_OS_URL", default="https://core.ufaas.io/api/v1/apps"
+    )
+    sso_url: str = os.getenv("SSO_URL", default="https://sso.ufaas.io/")
+    core_sso_url: str = os.getenv(
+        "CORE_SSO_URL", default="https://sso.ufaas.io/app-auth/access"
+    )
+
+    # upstream http client pools (one pool per upstream origin)
+    http2: bool = os.getenv("HTTP2", default="true").lower() in ("true", "1", "yes")
+    http_max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", default=100))
+    http_max_keepalive_connections: int = int(
+        os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", default=20)
+    )
+    http_keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", default=30))
+    http_timeout: float = float(os.getenv("HTTP_TIMEOUT", default=10))
+    http_connect_timeout: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", default=5))
+    # per-host overrides, e.g. '{"core.ufaas.io": {"max_connections": 200, "timeout": 5}}'
+    http_host_limits: str = os.getenv("HTTP_HOST_LIMITS", default="{}")
+
+    # bulkhead and circuit breaker of every upstream and ipg, see utils/resilience
+    upstream_max_concurrency: int = int(
+        os.getenv("UPSTREAM_MAX_CONCURRENCY", default=50)
+    )
+    upstream_max_queue: int = int(os.getenv("UPSTREAM_MAX_QUEUE", default=100))
+    circuit_failure_threshold: int = int(
+        os.getenv("CIRCUIT_FAILURE_THRESHOLD", default=5)
+    )
+    circuit_reset_timeout: float = float(os.getenv("CIRCUIT_RESET_TIMEOUT", default=30))
+    # per upstream or ipg overrides, e.g. '{"zarinpal": {"max_concurrency": 10}}'
+    upstream_limits: str = os.getenv("UPSTREAM_LIMITS", default="{}")
+    # hedged idempotent reads, see utils/hedging
+    hedge_requests: bool = os.getenv("HEDGE_REQUESTS", default="true").lower() in (
+        "true",
+        "1",
+        "yes",
+    )
+    hedge_quantile: float = float(os.getenv("HEDGE_QUANTILE", default=0.95))
+    hedge_min_delay: float = float(os.getenv("HEDGE_MIN_DELAY", default=0.02))
+    hedge_min_samples: int = int(os.getenv("HEDGE_MIN_SAMPLES", default=20))
+    hedge_window: int = int(os.getenv("HEDGE_WINDOW", default=256))
+    # extra requests allowed per request, and how many may be saved up
+    hedge_budget_ratio: float = float(os.getenv("HEDGE_BUDGET_RATIO", default=0.05))
+    hedge_budget_burst: int = int(os.getenv("HEDGE_BUDGET_BURST", default=5))
+
+    # seconds of upstream calls per http request, 0 disables the budget
+    request_latency_budget: float = float(
+        os.getenv("REQUEST_LATENCY_BUDGET", default=20)
+    )
+
+    # business access tokens are refreshed this many seconds before `exp`
+    access_token_refresh_margin: int = int(
+        os.getenv("ACCESS_TOKEN_REFRESH_MARGIN", default=30)
+    )
+    access_token_default_ttl: int = int(
+        os.getenv("ACCESS_TOKEN_DEFAULT_TTL", default=60)
+    )
+
+    # verified token claims are cached until `exp`, at most `jwt_cache_max_ttl`
+    jwt_cache_maxsize: int = int(os.getenv("JWT_CACHE_MAXSIZE", default=10000))
+    jwt_cache_max_ttl: int = int(os.getenv("JWT_CACHE_MAX_TTL", default=300))
+    # signing keys, refreshed in the background and on unknown key ids
+    usso_jwks_url: str = os.getenv("USSO_JWKS_URL")
+    jwks_refresh_interval: int = int(os.getenv("JWKS_REFRESH_INTERVAL", default=300))
+    jwks_min_refresh: int = int(os.getenv("JWKS_MIN_REFRESH", default=30))
+
+    # businesses by origin and name (seconds), stale ones are served while
+    # they are reloaded
+    business_cache_ttl: int = int(os.getenv("BUSINESS_CACHE_TTL", default=300))
+    business_cache_stale_ttl: int = int(
+        os.getenv("BUSINESS_CACHE_STALE_TTL", default=600)
+    )
+
+    # installed ipg discovery cache (seconds)
+    ipg_cache_ttl: int = int(os.getenv("IPG_CACHE_TTL", default=300))
+    ipg_cache_stale_ttl: int = int(os.getenv("IPG_CACHE_STALE_TTL", default=600))
+
+    # retrieve returns the payment without wallets/ipgs when their lookup fails
+    retrieve_partial_response: bool = os.getenv(
+        "RETRIEVE_PARTIAL_RESPONSE", default="true"
+    ).lower() in ("true", "1", "yes")
+    retrieve_lookup_timeout: float = float(
+        os.getenv("RETRIEVE_LOOKUP_TIMEOUT", default=5)
+    )
+
+    # purchase status callbacks of the ipgs, see apps/payment/callbacks.py
+    ipg_callback_secret: str = os.getenv("IPG_CALLBACK_SECRET", default="")
+    ipg_callback_max_skew: int = int(os.getenv("IPG_CALLBACK_MAX_SKEW", default=300))
+
+    # concurrent ipg status polls per verify
+    verify_concurrency: int = int(os.getenv("VERIFY_CONCURRENCY", default=4))
+
+    # proposal outbox workers
+    outbox_workers: int = int(os.getenv("OUTBOX_WORKERS", default=2))
+    outbox_poll_interval: float = float(os.getenv("OUTBOX_POLL_INTERVAL", default=1))
+    outbox_lease: int = int(os.getenv("OUTBOX_LEASE", default=60))
+    outbox_max_attempts: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", default=8))
+    outbox_backoff_base: float = float(os.getenv("OUTBOX_BACKOFF_BASE", default=2))
+    outbox_backoff_max: float = float(os.getenv("OUTBOX_BACKOFF_MAX", default=15 * 60))
+
+    # reconciliation of pending and overdue payments, 0 disables it
+    reconcile_interval: int = int(os.getenv("RECONCILE_INTERVAL", default=60))
+    reconcile_min_age: int = int(os.getenv("RECONCILE_MIN_AGE", default=120))
+    reconcile_page_size: int = int(os.getenv("RECONCILE_PAGE_SIZE", default=100))
+    reconcile_ipg_concurrency: int = int(
+        os.getenv("RECONCILE_IPG_CONCURRENCY", default=4)
+    )
+    # one process of the deployment sweeps at a time, holding a mongo lease
+    reconcile_lease: int = int(os.getenv("RECONCILE_LEASE", default=5 * 60))
+    # expired payments whose tries are still open at the ipg keep being
+    # reconciled this long after creation, so late captures still succeed
+    reconcile_failed_grace: int = int(
+        os.getenv("RECONCILE_FAILED_GRACE", default=60 * 60)
+    )
+
+    # log missing/unused indexes on startup
+    check_indexes: bool = os.getenv("CHECK_INDEXES", default="true").lower() in (
+        "true",
+        "1",
+        "yes",
+    )
+
+    # configuration cache, invalidated on writes and by a change stream if any;
+    # writes only reach the other worker processes through the stream, so
+    # without one the cache uses the shorter fallback ttl
+    config_cache_ttl: int = int(os.getenv("CONFIG_CACHE_TTL", default=300))
+    config_cache_fallback_ttl: int = int(
+        os.getenv("CONFIG_CACHE_FALLBACK_TTL", default=30)
+    )
+    config_change_stream: bool = os.getenv(
+        "CONFIG_CHANGE_STREAM", default="true"
+    ).lower() in ("true", "1", "yes")
+    config_stream_backoff_base: float = float(
+        os.getenv("CONFIG_STREAM_BACKOFF_BASE", default=1)
+    )
+    config_stream_backoff_max: float = float(
+        os.getenv("CONFIG_STREAM_BACKOFF_MAX", default=60)
+    )
+
+    # maximum number of payments accepted by one bulk create request
+    bulk_max_items: int = int(os.getenv("BULK_MAX_ITEMS", default=1000))
+
+    # opt-in request profiling of the payment routes, off unless one is set
+    profiling_secret: str | None = os.getenv("PROFILING_SECRET") or None
+    profiling_sample_rate: float = float(os.getenv("PROFILING_SAMPLE_RATE", default=0))
+    profiling_interval: float = float(os.getenv("PROFILING_INTERVAL", default=0.001))
+    profiles_max_count: int = int(os.getenv("PROFILES_MAX_COUNT", default=100))
+
+    # /metrics is only served to scrapers sending `Authorization: Bearer <token>`
+    metrics_token: str | None = os.getenv("METRICS_TOKEN") or None
+    # the pending outbox gauge is counted at most once per ttl, not per scrape
+    metrics_outbox_ttl: int = int(os.getenv("METRICS_OUTBOX_TTL", default=30))
+
+    # serving (app.py), one worker per cpu when WEB_CONCURRENCY is 0
+    host: str = os.getenv("HOST", default="0.0.0.0")
+    port: int = int(os.getenv("PORT", default=8000))
+    workers: int = int(os.getenv("WEB_CONCURRENCY", default=0))
+    # per worker, further connections get 503; 0 is unlimited
+    limit_concurrency: int = int(os.getenv("LIMIT_CONCURRENCY", default=0))
+    backlog: int = int(os.getenv("BACKLOG", default=2048))
+    # keep above the idle timeout of the proxy in front to avoid reset races
+    keep_alive_timeout: int = int(os.getenv("KEEP_ALIVE_TIMEOUT", default=65))
+    # in-flight requests get this long to finish on SIGTERM
+    graceful_shutdown_timeout: int = int(
+        os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", default=25)
+    )
@@ -1,12 +1,61 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import fastapi
 from fastapi_mongo_base.core import app_factory
 
+from apps.config import workers as config_workers
+from apps.config.models import Configuration
 from apps.config.routes import router as config_router
+from apps.payment import workers as payment_workers
+from apps.payment.models import Payment
 from apps.payment.routes import router as payment_router
+from utils.business import use_business_cache
+from utils.httpclient import HTTPClientPool
+from utils.indexes import check_indexes
+from utils.jwt_cache import jwks_refresher, use_jwt_cache
+from utils.metrics import MetricsMiddleware, metrics, register_mongo_listener
+from utils.profiling import router as profiles_router
+from utils.resilience import LatencyBudgetMiddleware
 
 from . import config
 
-app = app_factory.create_app(settings=config.Settings(), original_host_middleware=True)
+
+# before the lifespan creates the mongo client
+register_mongo_listener()
+use_business_cache()
+use_jwt_cache()
+
+
+@asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    async with app_factory.lifespan(app, settings=config.Settings()):
+        if config.Settings.check_indexes:
+            await check_indexes(Payment, Configuration)
+        app.state.http_clients = HTTPClientPool()
+        app.state.jwks_refresher = asyncio.create_task(jwks_refresher())
+        app.state.payment_workers = payment_workers.start_workers()
+        app.state.config_workers = config_workers.start_workers()
+        yield
+        await config_workers.stop_workers(app.state.config_workers)
+        await payment_workers.stop_workers(app.state.payment_workers)
+        app.state.jwks_refresher.cancel()
+        await app.state.http_clients.close()
+
+
+app = app_factory.create_app(
+    settings=config.Settings(),
+    original_host_middleware=True,
+    lifespan_func=lifespan,
+)
+app.add_middleware(LatencyBudgetMiddleware)
+app.add_middleware(MetricsMiddleware)
+if config.Settings.metrics_token:
+    app.get(f"{config.Settings.base_path}/metrics", include_in_schema=False)(metrics)
 app.include_router(
     config_router, prefix=f"{config.Settings.base_path}", include_in_schema=False
 )
 app.include_router(payment_router, prefix=f"{config.Settings.base_path}")
+app.include_router(
+    profiles_router, prefix=f"{config.Settings.base_path}", include_in_schema=False
+)
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+
+from utils.access_token import AccessTokenCache
+
+
+class FakeBusiness:
+    name = "token-test"
+
+    def __init__(self, lifetime: int):
+        self.lifetime = lifetime
+        self.calls = 0
+
+    async def get_access_token(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return jwt.encode(
+            {"exp": int(time.time()) + self.lifetime, "n": self.calls}, "access-token-cache-test-secret-key"
+        )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_refresh_is_single_flight():
+    cache = AccessTokenCache()
+    cache.invalidate()
+    business = FakeBusiness(lifetime=3600)
+
+    tokens = await asyncio.gather(*[cache.get(business) for _ in range(10)])
+
+    assert business.calls == 1
+    assert len(set(tokens)) == 1
+    assert await cache.get(business) == tokens[0]
+    assert business.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_token_refreshed_ahead_of_expiry():
+    cache = AccessTokenCache()
+    cache.invalidate()
+    # expires inside the refresh margin, so every call refreshes
+    business = FakeBusiness(lifetime=5)
+
+    await cache.get(business)
+    await cache.get(business)
+
+    assert business.calls == 2
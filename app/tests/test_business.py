@@ -0,0 +1,43 @@
+import pytest
+from ufaas_fastapi_business.models import Business
+
+from utils import business as business_utils
+
+BUSINESS = {
+    "name": "business-test",
+    "domain": "business-test.local",
+    "user_id": "00000000-0000-4000-8000-000000000001",
+}
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    calls = []
+
+    async def fetch_business(**params):
+        calls.append(params)
+        if params.get("name") == "unknown":
+            return None
+        return Business(**BUSINESS)
+
+    monkeypatch.setattr(business_utils, "fetch_business", fetch_business)
+    business_utils.business_cache.invalidate()
+    yield calls
+    business_utils.business_cache.invalidate()
+
+
+@pytest.mark.asyncio
+async def test_origin_lookup_serves_name_lookup(lookups):
+    by_origin = await business_utils.get_business_by_origin(BUSINESS["domain"])
+    by_name = await business_utils.get_business_by_name(BUSINESS["name"])
+
+    assert by_name is by_origin
+    assert lookups == [{"origin": BUSINESS["domain"]}]
+
+
+@pytest.mark.asyncio
+async def test_unknown_business_is_not_cached(lookups):
+    assert await business_utils.get_business_by_name("unknown") is None
+    assert await business_utils.get_business_by_name("unknown") is None
+
+    assert len(lookups) == 2
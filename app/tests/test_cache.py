@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from apps.payment.services import ipg_supports_currency
+from utils.cache import TTLCache
+from utils.resilience import UpstreamUnavailable, latency_budget, upstream_guard
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return self.calls
+
+
+@pytest.mark.asyncio
+async def test_cache_single_flight_and_invalidate():
+    cache = TTLCache(ttl=60)
+    loader = Loader()
+
+    values = await asyncio.gather(*[cache.get_or_load("b", loader) for _ in range(5)])
+    assert values == [1] * 5
+    assert loader.calls == 1
+
+    cache.invalidate("b")
+    assert await cache.get_or_load("b", loader) == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_stale_while_revalidate():
+    cache = TTLCache(ttl=0.01, stale_ttl=60)
+    loader = Loader()
+
+    assert await cache.get_or_load("b", loader) == 1
+    await asyncio.sleep(0.02)
+
+    # stale value is served while a reload runs in the background
+    assert await cache.get_or_load("b", loader) == 1
+    await asyncio.sleep(0.05)
+    assert loader.calls == 2
+    assert await cache.get_or_load("b", loader) == 2
+
+
+def test_ipg_currency_filter():
+    assert ipg_supports_currency({"name": "zarinpal"}, "IRR")
+    assert ipg_supports_currency({"name": "zarinpal", "currencies": ["IRR"]}, "IRR")
+    assert not ipg_supports_currency(
+        {"name": "stripe", "meta_data": {"currencies": ["USD"]}}, "IRR"
+    )
+
+
+@pytest.mark.asyncio
+async def test_shared_load_runs_without_the_starters_budget():
+    cache = TTLCache(ttl=60, name="budget-test")
+
+    async def loader():
+        async with upstream_guard("budget-test"):
+            await asyncio.sleep(0.05)
+        return "value"
+
+    async def budgeted():
+        async with latency_budget(0.01):
+            return await cache.get_or_load("b", loader)
+
+    budgeted_result, unbudgeted_result = await asyncio.gather(
+        budgeted(), cache.get_or_load("b", loader), return_exceptions=True
+    )
+
+    # the caller with a budget gives up on its own, the shared load goes on
+    assert isinstance(budgeted_result, UpstreamUnavailable)
+    assert unbudgeted_result == "value"
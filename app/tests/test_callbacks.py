@@ -0,0 +1,171 @@
+import time
+import uuid
+
+import pytest
+import pytest_asyncio
+from beanie import init_beanie
+from beanie.odm.utils.encoder import Encoder
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+from mongomock_motor import AsyncMongoMockClient
+from starlette.requests import Request
+from ufaas_fastapi_business.middlewares import AuthorizationData
+from ufaas_fastapi_business.models import Business
+
+from apps.payment import callbacks
+from apps.payment.models import Payment
+from apps.payment.schemas import (
+    PaymentStatus,
+    PurchaseCallbackSchema,
+    PurchaseSchema,
+    PurchaseStatus,
+)
+from server.config import Settings
+
+BUSINESS = Business(
+    name="callbacks-test",
+    domain="callbacks-test.local",
+    user_id="00000000-0000-4000-8000-000000000001",
+)
+BODY = b'{"uid": "00000000-0000-4000-8000-000000000001", "status": "SUCCESS"}'
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(Settings, "ipg_callback_secret", "callback-test-secret")
+
+
+def signed_request(timestamp: int, signature: str = None) -> Request:
+    timestamp = str(timestamp)
+    if signature is None:
+        signature = callbacks.callback_signature(timestamp, BODY)
+    headers = [
+        (b"x-timestamp", timestamp.encode()),
+        (b"x-signature", f"sha256={signature}".encode()),
+    ]
+    return Request({"type": "http", "headers": headers})
+
+
+def test_valid_signature():
+    request = signed_request(int(time.time()))
+
+    assert callbacks.valid_callback_signature(request, BODY)
+
+
+def test_tampered_body_is_rejected():
+    request = signed_request(int(time.time()))
+
+    assert not callbacks.valid_callback_signature(request, BODY.replace(b"S", b"F"))
+
+
+def test_stale_timestamp_is_rejected():
+    request = signed_request(int(time.time()) - Settings.ipg_callback_max_skew - 60)
+
+    assert not callbacks.valid_callback_signature(request, BODY)
+
+
+def test_signatures_need_a_secret(monkeypatch):
+    request = signed_request(int(time.time()))
+    monkeypatch.setattr(Settings, "ipg_callback_secret", "")
+
+    assert not callbacks.valid_callback_signature(request, BODY)
+
+
+@pytest_asyncio.fixture
+async def db():
+    client = AsyncMongoMockClient()
+    await init_beanie(
+        database=client.get_database("test_db"), document_models=[Payment]
+    )
+    yield
+    await Payment.find_all().delete()
+
+
+async def pending_payment(**fields) -> Payment:
+    payment = Payment(
+        business_name=BUSINESS.name,
+        user_id=uuid.uuid4(),
+        wallet_id=uuid.uuid4(),
+        amount=1000,
+        description="test",
+        callback_url="https://example.com/callback",
+        status=PaymentStatus.PENDING,
+        tries=[PurchaseSchema(ipg="test-ipg", status=PurchaseStatus.PENDING)],
+        **fields,
+    )
+    await payment.insert()
+    return payment
+
+
+async def stored(payment: Payment) -> Payment:
+    return await Payment.find_one({"uid": Encoder().encode(payment.uid)})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("issuer_type", ["App", "User", "Anonymous"])
+async def test_only_business_tokens_are_accepted(monkeypatch, issuer_type):
+    async def authorization_middleware(request, anonymous_accepted=False):
+        return AuthorizationData(issuer_type=issuer_type)
+
+    monkeypatch.setattr(callbacks, "authorization_middleware", authorization_middleware)
+    request = Request({"type": "http", "headers": []})
+
+    with pytest.raises(BaseHTTPException) as error:
+        await callbacks.authorize_callback(request, BODY)
+    assert error.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_callback_closes_the_purchase(db):
+    payment = await pending_payment()
+    data = PurchaseCallbackSchema(uid=payment.tries[0].uid, status="SUCCESS")
+
+    result = await callbacks.apply_purchase_callback(BUSINESS, data)
+    # a replayed callback changes nothing
+    replayed = await callbacks.apply_purchase_callback(BUSINESS, data)
+
+    assert result.status == replayed.status == PaymentStatus.SUCCESS
+    payment = await stored(payment)
+    assert payment.status == PaymentStatus.SUCCESS
+    assert payment.tries[0].status == PurchaseStatus.SUCCESS
+    assert payment.proposal.attempts == 0
+
+
+@pytest.mark.asyncio
+async def test_unknown_purchase_is_not_found(db):
+    payment = await pending_payment()
+
+    for data in (
+        PurchaseCallbackSchema(uid=uuid.uuid4(), status="SUCCESS"),
+        PurchaseCallbackSchema(
+            uid=payment.tries[0].uid, status="SUCCESS", ipg="other-ipg"
+        ),
+    ):
+        with pytest.raises(BaseHTTPException) as error:
+            await callbacks.apply_purchase_callback(BUSINESS, data)
+        assert error.value.status_code == 404
+    assert (await stored(payment)).status == PaymentStatus.PENDING
+
+
+@pytest.mark.asyncio
+async def test_lost_race_is_retried_on_the_new_state(db, monkeypatch):
+    payment = await pending_payment()
+    apply = Payment.apply_purchase_statuses
+    calls = []
+
+    async def racing_apply(self, statuses):
+        if not calls:
+            # the expiry sweep fails the payment between the read and the write
+            await Payment.find_one({"uid": Encoder().encode(payment.uid)}).update(
+                {"$set": {"status": PaymentStatus.FAILED.value}}
+            )
+        calls.append(self.status)
+        return await apply(self, statuses)
+
+    monkeypatch.setattr(Payment, "apply_purchase_statuses", racing_apply)
+    data = PurchaseCallbackSchema(uid=payment.tries[0].uid, status="SUCCESS")
+
+    result = await callbacks.apply_purchase_callback(BUSINESS, data)
+
+    assert calls == [PaymentStatus.PENDING, PaymentStatus.FAILED]
+    assert result.status == PaymentStatus.SUCCESS
+    assert (await stored(payment)).status == PaymentStatus.SUCCESS
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from apps.config import workers
+from apps.config.models import Configuration, config_cache
+from server.config import Settings
+
+
+class FailingCollection:
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.watches = 0
+
+    def watch(self, **kwargs):
+        self.watches += 1
+        raise self.errors.pop(0)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    monkeypatch.setattr(Settings, "config_stream_backoff_base", 0)
+    monkeypatch.setattr(config_cache, "ttl", Settings.config_cache_ttl)
+    collection = FailingCollection(
+        AutoReconnect("election"),
+        AutoReconnect("election"),
+        OperationFailure("not a replica set", code=40573),
+    )
+    monkeypatch.setattr(Configuration, "get_motor_collection", lambda: collection)
+    return collection
+
+
+@pytest.mark.asyncio
+async def test_watcher_retries_until_streams_are_unsupported(collection):
+    await asyncio.wait_for(workers.watch_configurations(), timeout=1)
+
+    assert collection.watches == 3
+    assert config_cache.ttl == Settings.config_cache_fallback_ttl
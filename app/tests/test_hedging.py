@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from server.config import Settings
+from utils.hedging import HedgePolicies, hedged
+
+
+@pytest.fixture
+def policy():
+    HedgePolicies().policies.clear()
+    policy = HedgePolicies().get("hedge-test")
+    for _ in range(Settings.hedge_min_samples):
+        policy.record(0.01)
+    yield policy
+    HedgePolicies().policies.clear()
+
+
+def slow_then_fast(delays: list[float]):
+    calls = []
+
+    async def call():
+        calls.append(len(calls))
+        await asyncio.sleep(delays[len(calls) - 1])
+        return len(calls)
+
+    return call, calls
+
+
+@pytest.mark.asyncio
+async def test_slow_request_is_hedged(policy):
+    call, calls = slow_then_fast([1, 0])
+
+    result = await asyncio.wait_for(hedged(call, "hedge-test"), timeout=0.5)
+
+    assert result == 2
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_fast_request_is_not_hedged(policy):
+    call, calls = slow_then_fast([0, 0])
+
+    await hedged(call, "hedge-test")
+
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_hedges_are_bounded_by_the_budget(policy):
+    policy.tokens = 0
+    call, calls = slow_then_fast([0.1, 0])
+
+    await hedged(call, "hedge-test")
+
+    assert len(calls) == 1
@@ -0,0 +1,19 @@
+import pytest
+
+from utils.httpclient import HTTPClientPool
+
+
+@pytest.mark.asyncio
+async def test_client_pool_per_origin():
+    pool = HTTPClientPool()
+    ipg = pool.get_client("https://core.ufaas.io/api/v1/apps/ipg/purchases/")
+    installeds = pool.get_client("https://core.ufaas.io/api/v1/apps/installeds/")
+    sso = pool.get_client("https://sso.ufaas.io/app-auth/access")
+
+    assert ipg is installeds
+    assert ipg is not sso
+
+    await pool.close()
+    assert ipg.is_closed
+    assert pool.get_client("https://core.ufaas.io/") is not ipg
+    await pool.close()
@@ -0,0 +1,66 @@
+import time
+
+import jwt
+import pytest
+from usso.exceptions import USSOException
+from usso.schemas import JWTConfig
+
+from utils import jwt_cache
+
+SECRET = "jwt-cache-test-secret-key-of-32-bytes"
+CONFIG = JWTConfig(secret=SECRET, algorithm="HS256")
+
+
+def make_token(lifetime: int = 3600, **claims) -> str:
+    payload = {"user_id": "00000000-0000-4000-8000-000000000001", **claims}
+    payload["exp"] = int(time.time()) + lifetime
+    return jwt.encode(payload, SECRET, algorithm="HS256")
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    calls = []
+    decode = jwt_cache.decode
+
+    def counting_decode(config, token):
+        calls.append(token)
+        return decode(config, token)
+
+    monkeypatch.setattr(jwt_cache, "decode", counting_decode)
+    jwt_cache.VerifiedTokenCache().invalidate()
+    yield calls
+    jwt_cache.VerifiedTokenCache().invalidate()
+
+
+def test_repeat_token_is_verified_once(decodes):
+    token = make_token()
+
+    first = jwt_cache.user_data_from_token(token, CONFIG)
+    second = jwt_cache.user_data_from_token(token, CONFIG)
+
+    assert second is first
+    assert len(decodes) == 1
+
+
+def test_token_evicted_at_exp(decodes):
+    token = make_token(lifetime=3600)
+    jwt_cache.user_data_from_token(token, CONFIG)
+    key = next(iter(jwt_cache.VerifiedTokenCache().entries))
+    user, _ = jwt_cache.VerifiedTokenCache().entries[key]
+    jwt_cache.VerifiedTokenCache().entries[key] = (user, time.time() - 1)
+
+    jwt_cache.user_data_from_token(token, CONFIG)
+
+    assert len(decodes) == 2
+
+
+def test_invalid_tokens_are_not_cached(decodes):
+    token = make_token(token_type="refresh")
+
+    for _ in range(2):
+        with pytest.raises(USSOException):
+            jwt_cache.user_data_from_token(token, CONFIG)
+    assert jwt_cache.user_data_from_token(token, CONFIG, raise_exception=False) is None
+
+    assert len(decodes) == 3
+    assert not jwt_cache.VerifiedTokenCache().entries
@@ -0,0 +1,31 @@
+import pytest
+import pytest_asyncio
+from beanie import init_beanie
+from mongomock_motor import AsyncMongoMockClient
+
+from utils.lease import Lease, acquire_lease
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def db():
+    client = AsyncMongoMockClient()
+    await init_beanie(database=client.get_database("test_db"), document_models=[Lease])
+    yield
+    await Lease.find_all().delete()
+
+
+@pytest.mark.asyncio
+async def test_one_holder_at_a_time():
+    assert await acquire_lease("job", 60, holder="a")
+    assert not await acquire_lease("job", 60, holder="b")
+    # the holder renews its own lease, other jobs have their own
+    assert await acquire_lease("job", 60, holder="a")
+    assert await acquire_lease("other-job", 60, holder="b")
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_taken_over():
+    assert await acquire_lease("job", 0, holder="a")
+
+    assert await acquire_lease("job", 60, holder="b")
+    assert not await acquire_lease("job", 60, holder="a")
@@ -0,0 +1,63 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+from apps.payment.models import Payment
+from server.config import Settings
+from utils import metrics
+
+
+@pytest.fixture
+def counts(monkeypatch):
+    counts = []
+
+    async def count_pending_proposals():
+        counts.append(1)
+        return 3
+
+    monkeypatch.setattr(Settings, "metrics_token", "metrics-test-token")
+    monkeypatch.setattr(Settings, "metrics_outbox_ttl", 30)
+    monkeypatch.setattr(metrics, "outbox_counted_at", {"at": float("-inf")})
+    monkeypatch.setattr(Payment, "count_pending_proposals", count_pending_proposals)
+    return counts
+
+
+@pytest.fixture
+def client(counts):
+    app = FastAPI()
+
+    @app.exception_handler(BaseHTTPException)
+    async def base_http_exception_handler(request, exc: BaseHTTPException):
+        return JSONResponse(status_code=exc.status_code, content={"error": exc.error})
+
+    app.get("/metrics")(metrics.metrics)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "headers",
+    [{}, {"Authorization": "Bearer forged"}, {"Authorization": "metrics-test-token"}],
+)
+async def test_scrape_needs_the_token(client, counts, headers):
+    async with client:
+        response = await client.get("/metrics", headers=headers)
+
+    assert response.status_code == 401
+    assert counts == []
+
+
+@pytest.mark.asyncio
+async def test_outbox_is_counted_once_per_ttl(client, counts):
+    headers = {"Authorization": "Bearer metrics-test-token"}
+    async with client:
+        first = await client.get("/metrics", headers=headers)
+        second = await client.get("/metrics", headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert "cashier_proposal_outbox_pending 3.0" in second.text
+    assert counts == [1]
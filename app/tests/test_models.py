@@ -0,0 +1,237 @@
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from beanie import init_beanie
+from beanie.odm.utils.encoder import Encoder
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from apps.payment.models import Payment
+from apps.payment.schemas import (
+    PaymentListSchema,
+    PaymentSchema,
+    PaymentStatus,
+    ProposalOutboxSchema,
+    ProposalStatus,
+    PurchaseSchema,
+    PurchaseStatus,
+)
+from server.config import Settings
+from utils.responses import document_response
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def db():
+    client = AsyncMongoMockClient()
+    await init_beanie(
+        database=client.get_database("test_db"), document_models=[Payment]
+    )
+    yield
+    await Payment.find_all().delete()
+
+
+def new_payment(**fields) -> Payment:
+    return Payment(
+        business_name="models-test",
+        user_id=uuid.uuid4(),
+        wallet_id=uuid.uuid4(),
+        amount=1000,
+        description="test",
+        callback_url="https://example.com/callback",
+        **fields,
+    )
+
+
+def open_try(**fields) -> PurchaseSchema:
+    return PurchaseSchema(ipg="test-ipg", status=PurchaseStatus.PENDING, **fields)
+
+
+@pytest.mark.asyncio
+async def test_expired_payments_with_open_tries_are_reconciled():
+    created_at = datetime.now() - timedelta(seconds=Settings.reconcile_failed_grace / 2)
+    expired = new_payment(
+        status=PaymentStatus.FAILED, tries=[open_try()], created_at=created_at
+    )
+    closed = new_payment(
+        status=PaymentStatus.FAILED,
+        tries=[PurchaseSchema(ipg="test-ipg", status=PurchaseStatus.FAILED)],
+        created_at=created_at,
+    )
+    abandoned = new_payment(
+        status=PaymentStatus.FAILED,
+        tries=[open_try()],
+        created_at=datetime.now()
+        - timedelta(seconds=Settings.reconcile_failed_grace + 60),
+    )
+    pending = new_payment(status=PaymentStatus.PENDING, tries=[open_try()])
+    await Payment.insert_many([expired, closed, abandoned, pending])
+
+    assert [payment.uid for payment in await Payment.list_pending()] == [pending.uid]
+    assert [payment.uid for payment in await Payment.list_pending(expired=True)] == [
+        expired.uid
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pending_pages_follow_the_created_at_keyset():
+    created_at = datetime.now() - timedelta(minutes=5)
+    payments = [
+        new_payment(status=PaymentStatus.PENDING, created_at=created_at)
+        for _ in range(3)
+    ] + [new_payment(status=PaymentStatus.PENDING)]
+    await Payment.insert_many(payments)
+
+    pages, after = [], None
+    while page := await Payment.list_pending(after=after, limit=2):
+        pages.append([payment.uid for payment in page])
+        after = (page[-1].created_at, page[-1].id)
+
+    assert sum(pages, []) == [payment.uid for payment in payments]
+    assert len(pages) == 2
+
+
+@pytest_asyncio.fixture
+async def mongod():
+    """Beanie on a real mongod, for updates mongomock does not implement."""
+    uri = os.getenv("MONGO_TEST_URI")
+    if not uri:
+        pytest.skip("MONGO_TEST_URI is not set")
+    client = AsyncIOMotorClient(uri)
+    database = client.get_database(f"test_models_{uuid.uuid4().hex[:8]}")
+    await init_beanie(database=database, document_models=[Payment])
+    yield
+    await client.drop_database(database.name)
+
+
+@pytest.mark.asyncio
+async def test_add_try_only_to_open_payments():
+    payment = new_payment()
+    await payment.insert()
+
+    assert await payment.add_try(open_try())
+    stored = await Payment.find_one({"uid": Encoder().encode(payment.uid)})
+    assert stored.status == PaymentStatus.PENDING
+    assert len(stored.tries) == 1
+
+    await stored.fail("test")
+    # the stale copy loses the race and sees the failed payment
+    assert not await payment.add_try(open_try())
+    assert payment.status == PaymentStatus.FAILED
+    assert len(payment.tries) == 1
+
+
+@pytest.mark.asyncio
+async def test_fail_and_success_guards():
+    payment = new_payment(status=PaymentStatus.PENDING)
+    await payment.insert()
+
+    assert await payment.fail("overdue")
+    assert not await payment.fail("again")
+    # a late capture overrides the expiry
+    assert await payment.success(ref_id=1)
+    assert payment.status == PaymentStatus.SUCCESS
+
+    refunded = new_payment(status=PaymentStatus.REFUNDED)
+    await refunded.insert()
+    assert not await refunded.success(ref_id=2)
+    assert refunded.status == PaymentStatus.REFUNDED
+
+
+@pytest.mark.asyncio
+async def test_purchase_status_with_the_positional_operator():
+    try_ = open_try()
+    payment = new_payment(status=PaymentStatus.PENDING, tries=[open_try(), try_])
+    await payment.insert()
+
+    assert await payment.success_purchase(try_.uid)
+
+    stored = await Payment.find_one({"uid": Encoder().encode(payment.uid)})
+    assert stored.status == PaymentStatus.SUCCESS
+    assert [t.status for t in stored.tries] == [
+        PurchaseStatus.PENDING,
+        PurchaseStatus.SUCCESS,
+    ]
+    assert stored.proposal is not None
+
+
+@pytest.mark.asyncio
+async def test_refunded_payment_stays_refunded():
+    try_ = open_try()
+    payment = new_payment(status=PaymentStatus.REFUNDED, tries=[try_])
+    await payment.insert()
+
+    await payment.success_purchase(try_.uid)
+
+    stored = await Payment.find_one({"uid": Encoder().encode(payment.uid)})
+    assert stored.status == PaymentStatus.REFUNDED
+    assert stored.proposal is None
+    assert payment.proposal is None
+
+
+@pytest.mark.asyncio
+async def test_lost_race_reloads_the_winner():
+    try_ = open_try()
+    payment = new_payment(status=PaymentStatus.PENDING, tries=[try_])
+    await payment.insert()
+    stale = await Payment.find_one({"uid": Encoder().encode(payment.uid)})
+
+    assert await payment.success_purchase(try_.uid)
+    assert not await stale.fail_purchase(try_.uid)
+
+    assert stale.status == PaymentStatus.SUCCESS
+    assert stale.tries[0].status == PurchaseStatus.SUCCESS
+
+
+@pytest.mark.asyncio
+async def test_purchase_statuses_with_array_filters(mongod):
+    tries = [open_try(), open_try()]
+    payment = new_payment(status=PaymentStatus.PENDING, tries=tries)
+    await payment.insert()
+
+    assert await payment.apply_purchase_statuses(
+        {tries[0].uid: PurchaseStatus.FAILED, tries[1].uid: PurchaseStatus.SUCCESS}
+    )
+
+    stored = await Payment.find_one({"uid": Encoder().encode(payment.uid)})
+    assert stored.status == PaymentStatus.SUCCESS
+    assert [t.status for t in stored.tries] == [
+        PurchaseStatus.FAILED,
+        PurchaseStatus.SUCCESS,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_proposal_claim_backoff_and_reclaim():
+    payment = new_payment(status=PaymentStatus.SUCCESS, proposal=ProposalOutboxSchema())
+    await payment.insert()
+
+    first = await Payment.claim_proposal(lease=60)
+    assert first.proposal.attempts == 1
+    assert await Payment.claim_proposal(lease=60) is None
+    assert await first.release_proposal(error="down", next_attempt_at=datetime.now())
+
+    second = await Payment.claim_proposal(lease=0)
+    assert second.proposal.attempts == 2
+    # the lease ran out and another worker claimed the proposal again
+    third = await Payment.claim_proposal(lease=60)
+    assert third.proposal.attempts == 3
+
+    assert not await second.release_proposal()
+    assert await third.release_proposal()
+    stored = await Payment.find_one({"uid": Encoder().encode(payment.uid)})
+    assert stored.proposal.status == ProposalStatus.DONE
+
+
+def test_proposal_is_not_in_api_responses():
+    payment = new_payment(status=PaymentStatus.SUCCESS, proposal=ProposalOutboxSchema())
+
+    retrieved = json.loads(document_response(payment).body)
+    listed = PaymentListSchema(items=[payment], offset=0, limit=1).model_dump()
+
+    assert "proposal" not in retrieved
+    assert "proposal" not in listed["items"][0]
+    assert "proposal" not in PaymentSchema.model_fields
@@ -0,0 +1,20 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+from utils.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_roundtrip():
+    created_at, uid = datetime(2024, 5, 1, 12, 30, 15, 123000), uuid.uuid4()
+    cursor = encode_cursor(created_at, uid)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, uid)
+
+
+def test_invalid_cursor():
+    with pytest.raises(BaseHTTPException):
+        decode_cursor("not-a-cursor")
@@ -0,0 +1,55 @@
+import time
+
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI
+
+from server.config import Settings
+from utils import profiling
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(Settings, "profiling_secret", "profiling-test-secret")
+    monkeypatch.setattr(Settings, "profiling_sample_rate", 0)
+    monkeypatch.setattr(Settings, "base_dir", tmp_path)
+
+    router = APIRouter(route_class=profiling.ProfilingRoute)
+
+    @router.get("/profiled")
+    async def profiled():
+        return {"ok": True}
+
+    app = FastAPI()
+    app.include_router(router)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    )
+
+
+def stored_profiles() -> list[str]:
+    return [path.name for path in profiling.profiles_dir().glob("*")]
+
+
+@pytest.mark.asyncio
+async def test_signed_request_is_profiled(client):
+    async with client:
+        response = await client.get(
+            "/profiled", headers={profiling.PROFILE_HEADER: profiling.profile_token()}
+        )
+
+    assert response.status_code == 200
+    assert stored_profiles() == [response.headers["X-Profile-Id"]]
+
+
+@pytest.mark.asyncio
+async def test_unsigned_request_is_not_profiled(client):
+    async with client:
+        response = await client.get(
+            "/profiled",
+            headers={profiling.PROFILE_HEADER: f"{int(time.time()) + 300}.forged"},
+        )
+
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+    assert stored_profiles() == []
@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+import pytest
+
+from server.config import Settings
+from utils.resilience import (
+    CircuitBreaker,
+    UpstreamGuards,
+    UpstreamUnavailable,
+    latency_budget,
+    upstream_guard,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_guards():
+    UpstreamGuards().guards.clear()
+    yield
+    UpstreamGuards().guards.clear()
+
+
+async def failing_call(upstream: str):
+    async with upstream_guard(upstream, "test-ipg"):
+        raise httpx.ConnectError("refused")
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_after_failures_and_fails_fast():
+    for _ in range(Settings.circuit_failure_threshold):
+        with pytest.raises(httpx.ConnectError):
+            await failing_call("breaker-test")
+
+    with pytest.raises(UpstreamUnavailable) as error:
+        await failing_call("breaker-test")
+    assert error.value.reason == "circuit_open"
+
+    # other ipgs of the same upstream are not affected
+    async with upstream_guard("breaker-test", "other-ipg"):
+        pass
+
+
+def test_half_open_circuit_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record(False)
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_full_bulkhead_rejects():
+    bulkhead, _ = UpstreamGuards().get("bulkhead-test", "test-ipg")
+    bulkhead.semaphore = asyncio.Semaphore(1)
+    bulkhead.max_queue = 0
+    release = asyncio.Event()
+
+    async def slow_call():
+        async with upstream_guard("bulkhead-test", "test-ipg"):
+            await release.wait()
+
+    task = asyncio.create_task(slow_call())
+    await asyncio.sleep(0)
+    with pytest.raises(UpstreamUnavailable) as error:
+        async with upstream_guard("bulkhead-test", "test-ipg"):
+            pass
+    assert error.value.reason == "bulkhead_full"
+
+    release.set()
+    await task
+
+
+@pytest.mark.asyncio
+async def test_call_times_out_with_the_request_budget():
+    with pytest.raises(UpstreamUnavailable) as error:
+        async with latency_budget(0.01):
+            async with upstream_guard("budget-test"):
+                await asyncio.sleep(1)
+    assert error.value.reason == "budget_exhausted"
+
+    with pytest.raises(UpstreamUnavailable):
+        async with latency_budget(0):
+            async with upstream_guard("budget-test"):
+                pass
@@ -0,0 +1,325 @@
+import asyncio
+import csv
+import io
+import json
+import uuid
+
+import httpx
+import pytest
+import pytest_asyncio
+from beanie import init_beanie
+from fastapi import FastAPI
+from fastapi_mongo_base.core.exceptions import (
+    BaseHTTPException,
+    base_http_exception_handler,
+)
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError
+from ufaas_fastapi_business.middlewares import AuthorizationData
+from ufaas_fastapi_business.models import Business
+
+from apps.config.models import Configuration, config_cache
+from apps.payment import routes, services
+from apps.payment.models import Payment
+from apps.payment.schemas import PaymentCreateSchema, PaymentStatus, PurchaseSchema
+from server.config import Settings
+from utils.resilience import UpstreamUnavailable
+
+BUSINESS = {
+    "name": "routes-test",
+    "domain": "routes-test.local",
+    "user_id": "00000000-0000-4000-8000-000000000001",
+}
+
+
+@pytest.fixture
+def auth() -> AuthorizationData:
+    """Authorization of every request, anonymous unless a test changes it."""
+    return AuthorizationData(business=Business(**BUSINESS), issuer_type="Anonymous")
+
+
+@pytest.fixture
+def client(monkeypatch, auth):
+    async def authorization_middleware(request, anonymous_accepted=False):
+        return auth
+
+    monkeypatch.setattr(routes, "authorization_middleware", authorization_middleware)
+    app = FastAPI()
+    app.add_exception_handler(BaseHTTPException, base_http_exception_handler)
+    app.include_router(routes.router)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url=f"http://{BUSINESS['domain']}"
+    )
+
+
+@pytest_asyncio.fixture
+async def db():
+    client = AsyncMongoMockClient()
+    await init_beanie(
+        database=client.get_database("test_db"),
+        document_models=[Payment, Configuration],
+    )
+    config_cache.invalidate()
+    yield
+    config_cache.invalidate()
+    await Payment.find_all().delete()
+    await Configuration.find_all().delete()
+
+
+@pytest_asyncio.fixture
+async def business_auth(auth, db):
+    auth.issuer_type = "Business"
+    auth.user_id = uuid.UUID(BUSINESS["user_id"])
+    await Configuration(business_name=BUSINESS["name"], ipgs=["test-ipg"]).insert()
+    return auth
+
+
+def payment_item(**fields) -> dict:
+    return {
+        "user_id": str(uuid.uuid4()),
+        "wallet_id": str(uuid.uuid4()),
+        "amount": 1000,
+        "description": "test",
+        "callback_url": "https://example.com/callback",
+        **fields,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/payments/", "/payments/export"])
+async def test_anonymous_listing_is_rejected(client, path):
+    async with client:
+        response = await client.get(path)
+
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_oversized_batch_is_rejected_by_the_schema(client):
+    items = [{} for _ in range(Settings.bulk_max_items + 1)]
+    async with client:
+        response = await client.post("/payments/bulk", json={"items": items})
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_bulk_creates_valid_items_and_reports_invalid_ones(client, business_auth):
+    items = [payment_item(), payment_item(amount="not a number"), payment_item()]
+    async with client:
+        response = await client.post("/payments/bulk", json={"items": items})
+
+    body = response.json()
+    assert response.status_code == 200
+    assert (body["created"], body["failed"]) == (2, 1)
+    assert [result["error"] is None for result in body["results"]] == [
+        True,
+        False,
+        True,
+    ]
+    payments = await Payment.find_all().to_list()
+    assert {str(payment.uid) for payment in payments} == {
+        body["results"][0]["uid"],
+        body["results"][2]["uid"],
+    }
+    assert all(payment.available_ipgs == ["test-ipg"] for payment in payments)
+
+
+@pytest.mark.asyncio
+async def test_bulk_write_errors_map_to_their_items(client, business_auth, monkeypatch):
+    async def insert_many(documents, **kwargs):
+        # the second inserted document, the third item after an invalid one
+        raise BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "duplicate key"}]})
+
+    monkeypatch.setattr(Payment, "insert_many", insert_many)
+    items = [payment_item(), payment_item(amount="not a number"), payment_item()]
+    async with client:
+        response = await client.post("/payments/bulk", json={"items": items})
+
+    results = response.json()["results"]
+    assert results[0]["error"] is None and results[0]["uid"]
+    assert results[2] == {"index": 2, "uid": None, "error": "duplicate key"}
+
+
+@pytest.mark.asyncio
+async def test_bulk_without_configuration_fails_per_item(client, business_auth):
+    await Configuration.find_all().delete()
+    items = [payment_item(), payment_item(available_ipgs=["test-ipg"])]
+    async with client:
+        response = await client.post("/payments/bulk", json={"items": items})
+
+    body = response.json()
+    assert response.status_code == 200
+    assert (body["created"], body["failed"]) == (1, 1)
+    assert body["results"][0]["error"] == "The business has no configuration"
+
+
+@pytest_asyncio.fixture
+async def user_auth(auth, db):
+    auth.issuer_type = "User"
+    auth.user_id = uuid.uuid4()
+    await Configuration(business_name=BUSINESS["name"], ipgs=["test-ipg"]).insert()
+    return auth
+
+
+@pytest.fixture
+def inserts(monkeypatch) -> list[Payment]:
+    inserted = []
+    insert = Payment.insert
+
+    async def counting_insert(self, **kwargs):
+        inserted.append(self.model_copy(deep=True))
+        return await insert(self, **kwargs)
+
+    monkeypatch.setattr(Payment, "insert", counting_insert)
+    return inserted
+
+
+START_PARAMS = {
+    "wallet_id": str(uuid.uuid4()),
+    "amount": 1000,
+    "description": "test",
+    "callback_url": "https://example.com/callback",
+}
+
+
+@pytest.mark.asyncio
+async def test_direct_start_inserts_once_with_the_first_try(
+    client, user_auth, inserts, monkeypatch
+):
+    purchase_uid = uuid.uuid4()
+
+    async def request_purchase(payment, business, ipg, **kwargs):
+        assert await Payment.find_all().count() == 0
+        return PurchaseSchema(uid=purchase_uid, ipg=ipg)
+
+    monkeypatch.setattr(services, "request_purchase", request_purchase)
+    async with client:
+        response = await client.get("/payments/start", params=START_PARAMS)
+
+    assert response.status_code == 307
+    assert str(purchase_uid) in response.headers["location"]
+    assert len(inserts) == 1
+    assert inserts[0].status == PaymentStatus.PENDING
+    assert [try_.uid for try_ in inserts[0].tries] == [purchase_uid]
+    stored = await Payment.find_all().to_list()
+    assert [payment.status for payment in stored] == [PaymentStatus.PENDING]
+
+
+@pytest.mark.asyncio
+async def test_direct_start_persists_nothing_when_the_ipg_is_unavailable(
+    client, user_auth, inserts, monkeypatch
+):
+    async def request_purchase(payment, business, ipg, **kwargs):
+        raise UpstreamUnavailable("purchases", ipg, "circuit_open")
+
+    monkeypatch.setattr(services, "request_purchase", request_purchase)
+    async with client:
+        response = await client.get("/payments/start", params=START_PARAMS)
+
+    assert response.status_code == 503
+    assert response.json()["error"] == "ipg_unavailable"
+    assert inserts == []
+    assert await Payment.find_all().count() == 0
+
+
+async def stored_payment(auth: AuthorizationData, **fields) -> Payment:
+    payment = Payment.from_create_schema(
+        PaymentCreateSchema.model_validate(payment_item(**fields)),
+        business_name=BUSINESS["name"],
+    )
+    payment.user_id = auth.user_id
+    await payment.insert()
+    return payment
+
+
+@pytest.mark.asyncio
+async def test_retrieve_skips_slow_and_failed_lookups(client, user_auth, monkeypatch):
+    monkeypatch.setattr(Settings, "retrieve_partial_response", True)
+    monkeypatch.setattr(Settings, "retrieve_lookup_timeout", 0.05)
+
+    async def get_wallets(business, user_id):
+        await asyncio.sleep(1)
+
+    async def payments_options(payment, business=None):
+        raise httpx.ConnectError("refused")
+
+    monkeypatch.setattr(routes, "get_wallets", get_wallets)
+    monkeypatch.setattr(routes, "payments_options", payments_options)
+    payment = await stored_payment(user_auth)
+
+    async with client:
+        response = await client.get(f"/payments/{payment.uid}")
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["uid"] == str(payment.uid)
+    assert body["wallets"] is None and body["ipgs"] is None
+
+
+@pytest.mark.asyncio
+async def test_retrieve_returns_the_lookups(client, user_auth, monkeypatch):
+    monkeypatch.setattr(Settings, "retrieve_partial_response", True)
+    ipg = {"name": "test-ipg", "domain": "ipg.local", "type": "ipg"}
+
+    async def get_wallets(business, user_id):
+        return []
+
+    async def payments_options(payment, business=None):
+        return [ipg]
+
+    monkeypatch.setattr(routes, "get_wallets", get_wallets)
+    monkeypatch.setattr(routes, "payments_options", payments_options)
+    payment = await stored_payment(user_auth)
+
+    async with client:
+        response = await client.get(f"/payments/{payment.uid}")
+
+    body = response.json()
+    assert body["wallets"] == [] and body["ipgs"] == [ipg]
+
+
+@pytest.mark.asyncio
+async def test_export_ndjson_with_a_projection(client, business_auth):
+    first = await stored_payment(business_auth, description="first")
+    second = await stored_payment(business_auth, description="second")
+
+    async with client:
+        response = await client.get(
+            "/payments/export", params={"format": "ndjson", "fields": "uid,amount"}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == [
+        {"uid": str(second.uid), "amount": "1000"},
+        {"uid": str(first.uid), "amount": "1000"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_csv_quotes_values(client, business_auth):
+    payment = await stored_payment(business_auth, description='say "hi", then go')
+
+    async with client:
+        response = await client.get(
+            "/payments/export", params={"format": "csv", "fields": "uid,description"}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert 'filename="payments.csv"' in response.headers["content-disposition"]
+    assert list(csv.DictReader(io.StringIO(response.text))) == [
+        {"uid": str(payment.uid), "description": 'say "hi", then go'}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_rejects_unknown_fields(client, business_auth):
+    async with client:
+        response = await client.get(
+            "/payments/export", params={"fields": "uid,proposal"}
+        )
+
+    assert response.status_code == 400
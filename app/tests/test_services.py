@@ -0,0 +1,125 @@
+import asyncio
+import uuid
+from collections import Counter, defaultdict
+
+import pytest
+import pytest_asyncio
+from beanie import init_beanie
+from mongomock_motor import AsyncMongoMockClient
+from ufaas_fastapi_business.models import Business
+
+from apps.payment import services
+from apps.payment.models import Payment
+from apps.payment.schemas import PaymentStatus, PurchaseSchema, PurchaseStatus
+from server.config import Settings
+
+BUSINESS = Business(
+    name="services-test",
+    domain="services-test.local",
+    user_id="00000000-0000-4000-8000-000000000001",
+)
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def db():
+    client = AsyncMongoMockClient()
+    await init_beanie(
+        database=client.get_database("test_db"), document_models=[Payment]
+    )
+
+
+def pending_payment(ipgs: list[str]) -> Payment:
+    return Payment(
+        business_name=BUSINESS.name,
+        user_id=uuid.uuid4(),
+        wallet_id=uuid.uuid4(),
+        amount=1000,
+        description="test",
+        callback_url="https://example.com/callback",
+        status=PaymentStatus.PENDING,
+        tries=[PurchaseSchema(ipg=ipg, status=PurchaseStatus.PENDING) for ipg in ipgs],
+    )
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Stubbed purchase polls, answered from `outcomes` by try uid."""
+
+    class Upstream:
+        outcomes: dict[uuid.UUID, PurchaseStatus | Exception] = {}
+        in_flight: Counter = Counter()
+        max_in_flight: dict[str, int] = defaultdict(int)
+        writes: list[dict] = []
+
+    async def get_access_token(business):
+        return "token"
+
+    async def get_purchase(business, ipg, uid, headers):
+        Upstream.in_flight[ipg] += 1
+        Upstream.in_flight["*"] += 1
+        for key in (ipg, "*"):
+            Upstream.max_in_flight[key] = max(
+                Upstream.max_in_flight[key], Upstream.in_flight[key]
+            )
+        await asyncio.sleep(0.01)
+        Upstream.in_flight[ipg] -= 1
+        Upstream.in_flight["*"] -= 1
+        outcome = Upstream.outcomes.get(uid, PurchaseStatus.PENDING)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return PurchaseSchema(uid=uid, ipg=ipg, status=outcome)
+
+    async def apply_purchase_statuses(self, statuses):
+        Upstream.writes.append(dict(statuses))
+        return True
+
+    monkeypatch.setattr(services, "get_access_token", get_access_token)
+    monkeypatch.setattr(services, "get_purchase", get_purchase)
+    monkeypatch.setattr(Payment, "apply_purchase_statuses", apply_purchase_statuses)
+    return Upstream
+
+
+@pytest.mark.asyncio
+async def test_polls_run_concurrently_within_the_bound(upstream, monkeypatch):
+    monkeypatch.setattr(Settings, "verify_concurrency", 2)
+    payment = pending_payment(["test-ipg"] * 5)
+    tries = payment.tries
+    upstream.outcomes = {
+        tries[0].uid: PurchaseStatus.SUCCESS,
+        tries[1].uid: PurchaseStatus.FAILED,
+        tries[2].uid: RuntimeError("ipg is down"),
+    }
+
+    await services.verify_payment(business=BUSINESS, payment=payment)
+
+    assert upstream.max_in_flight["*"] == 2
+    # a failed poll and open purchases are skipped, the rest written at once
+    assert upstream.writes == [
+        {tries[0].uid: PurchaseStatus.SUCCESS, tries[1].uid: PurchaseStatus.FAILED}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_shared_semaphores_bound_each_ipg(upstream):
+    payment = pending_payment(["ipg-a", "ipg-b"] * 3)
+    semaphores = defaultdict(lambda: asyncio.Semaphore(1))
+
+    await services.verify_payment(
+        business=BUSINESS, payment=payment, ipg_semaphores=semaphores
+    )
+
+    assert upstream.max_in_flight["ipg-a"] == upstream.max_in_flight["ipg-b"] == 1
+    assert upstream.max_in_flight["*"] == 2
+    assert upstream.writes == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [PaymentStatus.SUCCESS, PaymentStatus.REFUNDED])
+async def test_closed_payments_are_not_polled(upstream, status):
+    payment = pending_payment(["test-ipg"])
+    payment.status = status
+
+    await services.verify_payment(business=BUSINESS, payment=payment)
+
+    assert not upstream.max_in_flight
+    assert upstream.writes == []
@@ -0,0 +1,82 @@
+"""Expiry-aware access-token cache for business upstream calls.
+
+Tokens are kept per business until shortly before their JWT `exp` claim.
+Concurrent callers that find the token missing or about to expire share a
+single refresh call to the SSO instead of each fetching their own token.
+"""
+
+import asyncio
+import logging
+import time
+
+import jwt
+from singleton import Singleton
+from ufaas_fastapi_business.models import Business
+
+from server.config import Settings
+
+from .metrics import track_upstream
+from .resilience import await_shared, shared_task
+
+
+def get_token_expiry(token: str) -> float:
+    """Return the `exp` claim of a JWT, or a short default lifetime."""
+    try:
+        claims: dict = jwt.decode(token, options={"verify_signature": False})
+        return float(claims["exp"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return time.time() + Settings.access_token_default_ttl
+
+
+class AccessTokenCache(metaclass=Singleton):
+    def __init__(self):
+        self.tokens: dict[str, tuple[str, float]] = {}
+        self.refreshes: dict[str, asyncio.Task] = {}
+
+    def get_cached(self, business_name: str, margin: float = 0) -> str | None:
+        token, expiry = self.tokens.get(business_name, (None, 0))
+        if token and expiry - margin > time.time():
+            return token
+        return None
+
+    async def refresh(self, business: Business) -> str:
+        # bypass the short aiocache layer of the business model, we track expiry
+        async with track_upstream("sso", method="post"):
+            token = await business.get_access_token(cache_read=False)
+        if not token:
+            raise ValueError(f"No access token for business {business.name}")
+        self.tokens[business.name] = (token, get_token_expiry(token))
+        return token
+
+    async def get(self, business: Business) -> str:
+        token = self.get_cached(business.name, Settings.access_token_refresh_margin)
+        if token:
+            return token
+
+        task = self.refreshes.get(business.name)
+        if task is None:
+            task = shared_task(self.refresh(business))
+            self.refreshes[business.name] = task
+            task.add_done_callback(
+                lambda _: self.refreshes.pop(business.name, None)
+            )
+
+        try:
+            return await await_shared(task, "sso")
+        except Exception as e:
+            # keep serving a token that is still valid while the SSO misbehaves
+            token = self.get_cached(business.name)
+            if token is None:
+                raise
+            logging.warning(f"Access token refresh failed for {business.name}: {e}")
+            return token
+
+    def invalidate(self, business_name: str = None):
+        if business_name is None:
+            self.tokens.clear()
+        else:
+            self.tokens.pop(business_name, None)
+
+
+async def get_access_token(business: Business) -> str:
+    return await AccessTokenCache().get(business)
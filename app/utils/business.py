@@ -0,0 +1,76 @@
+"""Process-wide cache of businesses by request origin and by name.
+
+Every payment request resolves its business from the host, and the services
+resolve it again by name. Both lookups go through one `TTLCache`, a lookup by
+origin also fills the name entry, and failed reloads keep serving the stale
+business. Unknown businesses are not cached. Businesses are edited upstream,
+so entries only refresh when their TTL expires.
+"""
+
+import logging
+
+from fastapi import Request
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+from ufaas_fastapi_business import middlewares
+from ufaas_fastapi_business.models import Business
+
+from server.config import Settings
+
+from . import httpclient
+from .cache import TTLCache
+
+business_cache = TTLCache(
+    ttl=Settings.business_cache_ttl,
+    stale_ttl=Settings.business_cache_stale_ttl,
+    name="business",
+)
+
+
+async def fetch_business(**params) -> Business | None:
+    access_token = await Business.cls_access_token()
+    businesses = await httpclient.aio_request(
+        url=Settings.business_domains_url,
+        upstream="business",
+        params={"offset": 0, "limit": 1, **params},
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    items = (businesses or {}).get("items")
+    if not items:
+        return None
+    return Business(**items[0])
+
+
+async def get_cached_business(key: tuple[str, str], **params) -> Business | None:
+    try:
+        business = await business_cache.get_or_load(
+            key, lambda: fetch_business(**params)
+        )
+    except Exception as e:
+        logging.warning(f"Business lookup {key} failed: {e}")
+        return None
+    if business is None:
+        business_cache.invalidate(key)
+    return business
+
+
+async def get_business_by_origin(origin: str) -> Business | None:
+    business = await get_cached_business(("origin", origin), origin=origin)
+    if business is not None and business_cache.get(("name", business.name)) is None:
+        business_cache.set(("name", business.name), business)
+    return business
+
+
+async def get_business_by_name(name: str) -> Business | None:
+    return await get_cached_business(("name", name), name=name)
+
+
+async def get_business(request: Request) -> Business:
+    business = await get_business_by_origin(request.url.hostname)
+    if not business:
+        raise BaseHTTPException(404, "business_not_found", "business not found")
+    return business
+
+
+def use_business_cache():
+    """Resolve the business of `authorization_middleware` through the cache."""
+    middlewares.get_business = get_business
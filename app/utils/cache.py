@@ -0,0 +1,81 @@
+"""In-process async TTL cache with stale-while-revalidate."""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from .resilience import await_shared, shared_task
+
+MISSING = object()
+
+
+class TTLCache:
+    """Per-key cache of awaited values.
+
+    Entries younger than `ttl` are served as is. Entries younger than
+    `ttl + stale_ttl` are served while a single background reload refreshes
+    them. Older or missing entries are loaded inline, and concurrent loads of
+    the same key share one call to `loader`, which runs without the latency
+    budget of the request that started it; each waiter applies its own.
+    """
+
+    def __init__(
+        self, ttl: float, stale_ttl: float = 0, maxsize: int = 1024, name: str = "cache"
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.entries: dict[Hashable, tuple[Any, float]] = {}
+        self.loads: dict[Hashable, asyncio.Task] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value, stored_at = self.entries.get(key, (MISSING, 0))
+        if value is MISSING or time.monotonic() - stored_at >= self.ttl:
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.entries.pop(key, None)
+        while len(self.entries) >= self.maxsize:
+            self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = (value, time.monotonic())
+
+    def invalidate(self, key: Hashable = MISSING):
+        if key is MISSING:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    def load(self, key: Hashable, loader: Callable[[], Awaitable]) -> asyncio.Task:
+        task = self.loads.get(key)
+        if task is not None:
+            return task
+
+        async def load_and_store():
+            value = await loader()
+            self.set(key, value)
+            return value
+
+        def done(task: asyncio.Task):
+            self.loads.pop(key, None)
+            if not task.cancelled() and task.exception():
+                logging.warning(f"Cache load failed for {key}: {task.exception()}")
+
+        task = shared_task(load_and_store())
+        task.add_done_callback(done)
+        self.loads[key] = task
+        return task
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable]):
+        value, stored_at = self.entries.get(key, (MISSING, 0))
+        if value is not MISSING:
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.load(key, loader)
+                return value
+
+        return await await_shared(self.load(key, loader), self.name)
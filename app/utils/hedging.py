@@ -0,0 +1,113 @@
+"""Hedged idempotent reads.
+
+A hedged call that has not answered after the observed `hedge_quantile`
+latency of its (upstream, ipg) sends a second request and returns whichever
+answers first. Each pair earns `hedge_budget_ratio` hedges per call, up to
+`hedge_budget_burst`, which bounds the extra load a slow upstream gets.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from singleton import Singleton
+
+from server.config import Settings
+
+from .metrics import HEDGES_SENT, HEDGES_WON
+
+
+class HedgePolicy:
+    """Recent latencies and the hedge budget of one (upstream, ipg)."""
+
+    # recompute the hedge delay every this many samples
+    REFRESH_EVERY = 16
+
+    def __init__(self):
+        self.latencies: deque[float] = deque(maxlen=Settings.hedge_window)
+        self.samples = 0
+        self.cached_delay: float | None = None
+        self.tokens = float(Settings.hedge_budget_burst)
+
+    def record(self, latency: float):
+        self.latencies.append(latency)
+        self.samples += 1
+        if self.samples % self.REFRESH_EVERY == 0:
+            self.cached_delay = None
+
+    def delay(self) -> float | None:
+        """Seconds to wait before hedging, None while there are too few samples."""
+        if len(self.latencies) < Settings.hedge_min_samples:
+            return None
+        if self.cached_delay is None:
+            latencies = sorted(self.latencies)
+            index = min(
+                len(latencies) - 1, int(len(latencies) * Settings.hedge_quantile)
+            )
+            self.cached_delay = max(Settings.hedge_min_delay, latencies[index])
+        return self.cached_delay
+
+    def earn(self):
+        self.tokens = min(
+            Settings.hedge_budget_burst, self.tokens + Settings.hedge_budget_ratio
+        )
+
+    def spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class HedgePolicies(metaclass=Singleton):
+    def __init__(self):
+        self.policies: dict[tuple[str, str], HedgePolicy] = {}
+
+    def get(self, upstream: str, ipg: str = None) -> HedgePolicy:
+        key = (upstream, ipg or "")
+        policy = self.policies.get(key)
+        if policy is None:
+            policy = self.policies[key] = HedgePolicy()
+        return policy
+
+
+async def hedged(call: Callable[[], Awaitable], upstream: str, ipg: str = None):
+    """Await `call()`, hedged with a second `call()` when the first is slow."""
+    policy = HedgePolicies().get(upstream, ipg)
+    policy.earn()
+
+    async def timed_call():
+        start = time.perf_counter()
+        result = await call()
+        policy.record(time.perf_counter() - start)
+        return result
+
+    delay = policy.delay()
+    primary = asyncio.ensure_future(timed_call())
+    if delay is None:
+        return await primary
+
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done or not policy.spend():
+            return await primary
+
+        HEDGES_SENT.labels(upstream, ipg or "").inc()
+        hedge = asyncio.ensure_future(timed_call())
+        pending.add(hedge)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        HEDGES_WON.labels(upstream, ipg or "").inc()
+                    return task.result()
+        # both failed, report the original request's error
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
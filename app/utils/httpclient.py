@@ -0,0 +1,108 @@
+"""Shared keep-alive HTTP clients for upstream calls.
+
+Every upstream origin (IPG, core, installeds, ...) gets its own pooled
+`httpx.AsyncClient` that lives as long as the app, so repeated calls reuse
+TCP/TLS connections instead of opening a new one per request.
+"""
+
+import json
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi_mongo_base.utils import aionetwork
+from singleton import Singleton
+
+from server.config import Settings
+
+from .hedging import hedged
+from .metrics import track_upstream
+from .resilience import upstream_guard
+
+
+class HTTPClientPool(metaclass=Singleton):
+    """App-lifetime http clients keyed by upstream origin."""
+
+    def __init__(self):
+        self.clients: dict[str, httpx.AsyncClient] = {}
+
+    @staticmethod
+    def get_origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    @staticmethod
+    def host_config(host: str) -> dict:
+        try:
+            host_limits: dict = json.loads(Settings.http_host_limits)
+        except ValueError:
+            logging.error(f"Invalid HTTP_HOST_LIMITS {Settings.http_host_limits}")
+            host_limits = {}
+        return host_limits.get(host, {})
+
+    def create_client(self, host: str) -> httpx.AsyncClient:
+        host_config = self.host_config(host)
+        limits = httpx.Limits(
+            max_connections=host_config.get(
+                "max_connections", Settings.http_max_connections
+            ),
+            max_keepalive_connections=host_config.get(
+                "max_keepalive_connections", Settings.http_max_keepalive_connections
+            ),
+            keepalive_expiry=host_config.get(
+                "keepalive_expiry", Settings.http_keepalive_expiry
+            ),
+        )
+        timeout = httpx.Timeout(
+            host_config.get("timeout", Settings.http_timeout),
+            connect=host_config.get("connect_timeout", Settings.http_connect_timeout),
+        )
+        return httpx.AsyncClient(
+            limits=limits,
+            timeout=timeout,
+            http2=host_config.get("http2", Settings.http2),
+        )
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        origin = self.get_origin(url)
+        client = self.clients.get(origin)
+        if client is None or client.is_closed:
+            client = self.create_client(urlsplit(url).hostname)
+            self.clients[origin] = client
+        return client
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+async def aio_request(
+    *,
+    method: str = "get",
+    url: str = None,
+    upstream: str = None,
+    ipg: str = None,
+    hedge: bool = False,
+    **kwargs,
+) -> dict:
+    """Drop-in replacement of `aionetwork.aio_request` using the pooled clients.
+
+    Requests are timed by `upstream` (the host when not given) and `ipg`, and
+    run in their bulkhead, circuit breaker and the current latency budget.
+    Idempotent GETs may pass `hedge=True` to be hedged when slow.
+    """
+    url = await aionetwork.prepare_url(url)
+    client = HTTPClientPool().get_client(url)
+    upstream = upstream or urlsplit(url).hostname
+
+    async def request():
+        async with upstream_guard(upstream, ipg):
+            async with track_upstream(upstream, ipg, method):
+                return await aionetwork.aio_request_client(
+                    client, method=method, url=url, **kwargs
+                )
+
+    if hedge and Settings.hedge_requests and method.lower() == "get":
+        return await hedged(request, upstream, ipg)
+    return await request()
@@ -0,0 +1,46 @@
+"""Startup report of missing and unused collection indexes."""
+
+import logging
+
+from beanie import Document
+
+
+def index_key(key) -> tuple:
+    return tuple((field, direction) for field, direction in dict(key).items())
+
+
+async def check_indexes(*models: type[Document]) -> dict[str, dict[str, list]]:
+    """Compare the declared indexes of each model with the collection.
+
+    Reports declared indexes missing from the collection and existing
+    indexes that have not served any operation since the server started.
+    """
+    report = {}
+    for model in models:
+        collection = model.get_motor_collection()
+        existing = await collection.index_information()
+        existing_keys = {index_key(info["key"]) for info in existing.values()}
+
+        missing = [
+            index.document["name"]
+            for index in getattr(model.Settings, "indexes", [])
+            if index_key(index.document["key"]) not in existing_keys
+        ]
+
+        try:
+            stats = await collection.aggregate([{"$indexStats": {}}]).to_list(None)
+        except Exception as e:
+            logging.info(f"index usage of {model.__name__} not available: {e}")
+            stats = []
+        unused = [
+            stat["name"]
+            for stat in stats
+            if stat["name"] != "_id_" and not stat["accesses"]["ops"]
+        ]
+
+        if missing:
+            logging.warning(f"{model.__name__} is missing indexes {missing}")
+        if unused:
+            logging.info(f"{model.__name__} has unused indexes {unused}")
+        report[model.__name__] = {"missing": missing, "unused": unused}
+    return report
@@ -0,0 +1,218 @@
+"""Verified-token and JWKS caches in front of usso's JWT verification.
+
+Verified claims are kept in a bounded LRU keyed by the token hash and the
+verifying config until the token's `exp`, so repeat clients skip signature
+checks. Signing keys come from JWKS documents (`USSO_JWKS_URL` and every
+`jwk_url` seen) that a background task refreshes, so a verification never
+fetches keys on the event loop unless it meets an unknown key id.
+"""
+
+import asyncio
+import functools
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+import jwt
+from fastapi import Request
+from singleton import Singleton
+from starlette.status import HTTP_401_UNAUTHORIZED
+from ufaas_fastapi_business import middlewares
+from usso import core as usso_core
+from usso.exceptions import USSOException
+from usso.fastapi import integration as usso_fastapi
+from usso.schemas import JWTConfig, UserData
+
+from server.config import Settings
+
+from . import httpclient
+from .resilience import shared_task
+
+
+class JWKSCache(metaclass=Singleton):
+    """Signing keys by JWKS url and key id."""
+
+    def __init__(self):
+        self.keys: dict[str, dict[str, jwt.PyJWK]] = {}
+        self.refreshed_at: dict[str, float] = {}
+        self.refreshes: dict[str, asyncio.Task] = {}
+
+    def signing_key(self, jwk_url: str, kid: str | None) -> jwt.PyJWK | None:
+        keys = self.keys.get(jwk_url)
+        if keys is None:
+            return None
+        if kid is None:
+            return next(iter(keys.values()), None) if len(keys) == 1 else None
+        return keys.get(kid)
+
+    async def refresh(self, jwk_url: str):
+        data = await httpclient.aio_request(url=jwk_url, upstream="jwks")
+        key_set = jwt.PyJWKSet.from_dict(data)
+        self.keys[jwk_url] = {key.key_id: key for key in key_set.keys}
+        self.refreshed_at[jwk_url] = time.monotonic()
+
+    def request_refresh(self, jwk_url: str):
+        """Refresh a JWKS in the background, at most every `jwks_min_refresh`."""
+        if jwk_url in self.refreshes:
+            return
+        last = self.refreshed_at.get(jwk_url)
+        if last is not None and time.monotonic() - last < Settings.jwks_min_refresh:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = shared_task(self.refresh(jwk_url))
+        self.refreshes[jwk_url] = task
+
+        def done(task: asyncio.Task):
+            self.refreshes.pop(jwk_url, None)
+            if not task.cancelled() and task.exception():
+                logging.warning(f"JWKS refresh of {jwk_url} failed: {task.exception()}")
+
+        task.add_done_callback(done)
+
+    async def refresh_all(self):
+        urls = set(self.keys)
+        if Settings.usso_jwks_url:
+            urls.add(Settings.usso_jwks_url)
+        results = await asyncio.gather(
+            *[self.refresh(url) for url in urls], return_exceptions=True
+        )
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logging.warning(f"JWKS refresh of {url} failed: {result}")
+
+
+async def jwks_refresher():
+    while True:
+        await JWKSCache().refresh_all()
+        await asyncio.sleep(Settings.jwks_refresh_interval)
+
+
+class VerifiedTokenCache(metaclass=Singleton):
+    """LRU of verified token claims, each kept until its `exp`."""
+
+    def __init__(self):
+        self.entries: OrderedDict[tuple, tuple[UserData, float]] = OrderedDict()
+
+    def get(self, key: tuple) -> UserData | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return user
+
+    def set(self, key: tuple, user: UserData):
+        expires_at = time.time() + Settings.jwt_cache_max_ttl
+        exp = (user.data or {}).get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        self.entries[key] = (user, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > Settings.jwt_cache_maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self):
+        self.entries.clear()
+
+
+@functools.cache
+def env_jwt_configs() -> tuple[JWTConfig, ...]:
+    return tuple(usso_core.Usso().jwt_configs)
+
+
+def jwt_configs(jwt_config=None) -> tuple[JWTConfig, ...]:
+    if jwt_config is None:
+        return env_jwt_configs()
+    if isinstance(jwt_config, JWTConfig):
+        return (jwt_config,)
+    return tuple(usso_core.Usso(jwt_config=jwt_config).jwt_configs)
+
+
+def decode(config: JWTConfig, token: str) -> UserData:
+    if not config.jwk_url:
+        return usso_core.decode_token(
+            config.secret, token, algorithms=[config.algorithm]
+        )
+
+    jwks = JWKSCache()
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except jwt.InvalidTokenError:
+        raise USSOException(status_code=HTTP_401_UNAUTHORIZED, error="invalid_token")
+    key = jwks.signing_key(config.jwk_url, kid)
+    if key is None:
+        # unknown url or key id, usso fetches the keys itself this once
+        jwks.request_refresh(config.jwk_url)
+        return usso_core.decode_token_with_jwk(config.jwk_url, token)
+    return usso_core.decode_token(key.key, token, algorithms=[key.algorithm_name])
+
+
+def user_data_from_token(
+    token: str, jwt_config=None, raise_exception: bool = True
+) -> UserData | None:
+    """`Usso.user_data_from_token` through the verified-token cache."""
+    configs = jwt_configs(jwt_config)
+    token_hash = hashlib.sha256(token.encode()).digest()
+    cache = VerifiedTokenCache()
+    error = None
+    for config in configs:
+        key = (token_hash, config.jwk_url, config.secret, config.algorithm)
+        user = cache.get(key)
+        if user is not None:
+            return user
+        try:
+            user = decode(config, token)
+            if user.token_type.lower() != "access":
+                raise USSOException(
+                    status_code=HTTP_401_UNAUTHORIZED, error="invalid_token_type"
+                )
+        except USSOException as e:
+            error = e
+            continue
+        cache.set(key, user)
+        return user
+
+    if raise_exception:
+        if error:
+            raise error
+        raise USSOException(status_code=HTTP_401_UNAUTHORIZED, error="unauthorized")
+    if error:
+        logging.error(error.message or error.error)
+    return None
+
+
+def jwt_access_security_None(request: Request, jwt_config=None) -> UserData | None:
+    """Cached `usso.fastapi.jwt_access_security_None`."""
+    if request.headers.get("x-api-key"):
+        return usso_fastapi.jwt_access_security_None(request, jwt_config=jwt_config)
+    token = usso_fastapi.get_request_token(request)
+    if not token:
+        return None
+    return user_data_from_token(token, jwt_config, raise_exception=False)
+
+
+def jwt_access_security(request: Request, jwt_config=None) -> UserData | None:
+    """Cached `usso.fastapi.jwt_access_security`."""
+    if request.headers.get("x-api-key"):
+        return usso_fastapi.jwt_access_security(request, jwt_config=jwt_config)
+    token = usso_fastapi.get_request_token(request)
+    if not token:
+        raise USSOException(
+            status_code=HTTP_401_UNAUTHORIZED,
+            error="unauthorized",
+            message="No token provided",
+        )
+    return user_data_from_token(token, jwt_config)
+
+
+def use_jwt_cache():
+    """Verify the tokens of `authorization_middleware` through the caches."""
+    middlewares.jwt_access_security = jwt_access_security
+    middlewares.jwt_access_security_None = jwt_access_security_None
@@ -0,0 +1,61 @@
+"""Mongo leases that elect one process to run a periodic job.
+
+Every uvicorn worker of every replica starts the same schedulers; a job that
+must run once per interval, not once per process, only runs while its caller
+holds the job's lease. A holder renews it on every run, and another process
+takes over once a lease is left to expire.
+"""
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from beanie.odm.utils.encoder import Encoder
+from fastapi_mongo_base.models import BaseEntity
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease(BaseEntity):
+    name: str
+    holder: str
+    expires_at: datetime
+
+    class Settings:
+        indexes = BaseEntity.Settings.indexes + [
+            IndexModel([("name", ASCENDING)], unique=True),
+        ]
+
+
+async def acquire_lease(name: str, ttl: float, holder: str = HOLDER) -> bool:
+    """Take or renew the lease `name` for `ttl` seconds, if it is free or ours."""
+    now = datetime.now()
+    try:
+        await Lease.get_motor_collection().update_one(
+            {
+                "name": name,
+                "$or": [{"holder": holder}, {"expires_at": {"$lte": now}}],
+            },
+            Encoder().encode(
+                {
+                    "$set": {
+                        "holder": holder,
+                        "expires_at": now + timedelta(seconds=ttl),
+                        "updated_at": now,
+                    },
+                    "$setOnInsert": {
+                        "uid": uuid.uuid4(),
+                        "created_at": now,
+                        "is_deleted": False,
+                    },
+                }
+            ),
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # the lease exists, is held by another process and has not expired
+        return False
+    return True
@@ -0,0 +1,218 @@
+"""Prometheus metrics of upstream calls, mongo commands and routes."""
+
+import hmac
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+from starlette.requests import Request
+from starlette.responses import Response
+
+from server.config import Settings
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "cashier_upstream_request_seconds",
+    "Latency of upstream http requests.",
+    ["upstream", "ipg", "method"],
+)
+UPSTREAM_ERRORS = Counter(
+    "cashier_upstream_errors_total",
+    "Failed upstream http requests.",
+    ["upstream", "ipg", "error"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "cashier_upstream_in_flight",
+    "Upstream http requests in flight.",
+    ["upstream"],
+    multiprocess_mode="livesum",
+)
+UPSTREAM_REJECTED = Counter(
+    "cashier_upstream_rejected_total",
+    "Upstream calls refused by their bulkhead, circuit breaker or budget.",
+    ["upstream", "ipg", "reason"],
+)
+HEDGES_SENT = Counter(
+    "cashier_upstream_hedges_sent_total",
+    "Second requests sent for slow idempotent upstream reads.",
+    ["upstream", "ipg"],
+)
+HEDGES_WON = Counter(
+    "cashier_upstream_hedges_won_total",
+    "Hedged requests that answered before the original one.",
+    ["upstream", "ipg"],
+)
+
+MONGO_COMMAND_SECONDS = Histogram(
+    "cashier_mongo_command_seconds",
+    "Latency of mongo commands.",
+    ["collection", "command"],
+)
+MONGO_COMMAND_ERRORS = Counter(
+    "cashier_mongo_command_errors_total",
+    "Failed mongo commands.",
+    ["collection", "command"],
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "cashier_http_request_seconds",
+    "Latency of handled http requests.",
+    ["method", "route", "status"],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "cashier_http_in_flight", "Http requests in flight.", multiprocess_mode="livesum"
+)
+
+PROPOSAL_OUTBOX_PENDING = Gauge(
+    "cashier_proposal_outbox_pending",
+    "Proposals of successful payments not yet sent to the core.",
+    multiprocess_mode="mostrecent",
+)
+
+
+def upstream_error(error: Exception) -> str:
+    response = getattr(error, "response", None)
+    if response is not None:
+        return str(response.status_code)
+    return type(error).__name__
+
+
+@asynccontextmanager
+async def track_upstream(upstream: str, ipg: str = None, method: str = "get"):
+    """Time an upstream call and count it as failed when it raises."""
+    in_flight = UPSTREAM_IN_FLIGHT.labels(upstream)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        UPSTREAM_ERRORS.labels(upstream, ipg or "", upstream_error(e)).inc()
+        raise
+    finally:
+        in_flight.dec()
+        UPSTREAM_REQUEST_SECONDS.labels(upstream, ipg or "", method.upper()).observe(
+            time.perf_counter() - start
+        )
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Time every mongo command by collection, i.e. by document model."""
+
+    # commands whose first value is not a collection name
+    IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions"}
+
+    def __init__(self):
+        self.collections: dict[tuple, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name in self.IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        self.collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection = self.collections.pop((event.connection_id, event.request_id), None)
+        if collection is None:
+            return
+        MONGO_COMMAND_SECONDS.labels(collection, event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self.collections.pop((event.connection_id, event.request_id), None)
+        if collection is None:
+            return
+        MONGO_COMMAND_SECONDS.labels(collection, event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+        MONGO_COMMAND_ERRORS.labels(collection, event.command_name).inc()
+
+
+def register_mongo_listener():
+    """Listen to the commands of mongo clients created from now on."""
+    monitoring.register(MongoCommandListener())
+
+
+class MetricsMiddleware:
+    """Time every request by its route template, e.g. /payments/{uid}."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status["code"]),
+            ).observe(time.perf_counter() - start)
+
+
+def metrics_authorized(request: Request) -> bool:
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return (
+        bool(Settings.metrics_token)
+        and scheme.lower() == "bearer"
+        and hmac.compare_digest(token.encode(), Settings.metrics_token.encode())
+    )
+
+
+outbox_counted_at = {"at": float("-inf")}
+
+
+async def count_outbox_pending():
+    """Refresh the pending outbox gauge at most once per `metrics_outbox_ttl`."""
+    from apps.payment.models import Payment
+
+    now = time.monotonic()
+    if now - outbox_counted_at["at"] < Settings.metrics_outbox_ttl:
+        return
+    # claimed before counting so concurrent scrapes share a single count
+    outbox_counted_at["at"] = now
+    try:
+        PROPOSAL_OUTBOX_PENDING.set(await Payment.count_pending_proposals())
+    except Exception as e:
+        logging.warning(f"count pending proposals: {e}")
+
+
+async def metrics(request: Request):
+    if not metrics_authorized(request):
+        raise BaseHTTPException(401, "unauthorized", "Unauthorized")
+
+    await count_outbox_pending()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # served by one of several workers, aggregate the metrics of all
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
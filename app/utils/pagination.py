@@ -0,0 +1,32 @@
+"""Opaque keyset cursors on `(created_at, uid)`."""
+
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+
+def encode_cursor(created_at: datetime, uid: uuid.UUID) -> str:
+    raw = json.dumps([created_at.isoformat(), str(uid)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, uid = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(uid)
+    except (ValueError, TypeError):
+        raise BaseHTTPException(400, "invalid_cursor", "Invalid pagination cursor")
+
+
+def keyset_query(created_at: datetime, uid: uuid.UUID) -> dict:
+    """Items after the cursor in `(created_at desc, uid desc)` order."""
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "uid": {"$lt": uid}},
+        ]
+    }
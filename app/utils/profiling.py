@@ -0,0 +1,156 @@
+"""Opt-in sampling profiles of single requests.
+
+A request is profiled when it carries a valid signed `X-Profile` header
+(`PROFILING_SECRET` set) or is picked by `PROFILING_SAMPLE_RATE`. Profiles are
+stored as speedscope json under logs/profiles and served by the admin routes.
+When neither is configured the routes keep their plain handler.
+
+    python -c "from utils.profiling import profile_token; print(profile_token())"
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import re
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse
+from fastapi.routing import APIRoute
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+from server.config import Settings
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:
+    Profiler = None
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_SUFFIX = ".speedscope.json"
+
+
+def profiles_dir() -> Path:
+    return Settings.base_dir / "logs" / "profiles"
+
+
+def profiling_active() -> bool:
+    return bool(Settings.profiling_secret or Settings.profiling_sample_rate > 0)
+
+
+def profile_signature(expires: int) -> str:
+    return hmac.new(
+        Settings.profiling_secret.encode(), str(expires).encode(), hashlib.sha256
+    ).hexdigest()
+
+
+def profile_token(ttl: int = 300) -> str:
+    """A `X-Profile` header value valid for `ttl` seconds."""
+    expires = int(time.time()) + ttl
+    return f"{expires}.{profile_signature(expires)}"
+
+
+def valid_profile_token(token: str | None) -> bool:
+    if not token or not Settings.profiling_secret:
+        return False
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, profile_signature(int(expires)))
+
+
+def should_profile(request: Request) -> bool:
+    if valid_profile_token(request.headers.get(PROFILE_HEADER)):
+        return True
+    return random.random() < Settings.profiling_sample_rate
+
+
+def write_profile(name: str, profile: str):
+    directory = profiles_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / name).write_text(profile)
+    # keep the newest profiles only
+    profiles = sorted(directory.glob(f"*{PROFILE_SUFFIX}"), key=lambda p: p.name)
+    for old in profiles[: -Settings.profiles_max_count]:
+        old.unlink(missing_ok=True)
+
+
+async def save_profile(profiler: "Profiler", request: Request) -> str:
+    route = re.sub(r"[^a-zA-Z0-9]+", "-", request.url.path).strip("-")
+    name = (
+        f"{datetime.now():%Y%m%d-%H%M%S}-{request.method.lower()}-{route}"
+        f"-{uuid.uuid4().hex[:8]}{PROFILE_SUFFIX}"
+    )
+    profile = profiler.output(SpeedscopeRenderer())
+    await asyncio.to_thread(write_profile, name, profile)
+    return name
+
+
+class ProfilingRoute(APIRoute):
+    """Route that profiles the requests picked by `should_profile`."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if not profiling_active():
+            return handler
+        if Profiler is None:
+            logging.warning("Profiling is configured but pyinstrument is missing")
+            return handler
+
+        async def profiled_handler(request: Request):
+            if not should_profile(request):
+                return await handler(request)
+
+            profiler = Profiler(
+                interval=Settings.profiling_interval, async_mode="enabled"
+            )
+            profiler.start()
+            try:
+                response = await handler(request)
+            finally:
+                profiler.stop()
+                name = await save_profile(profiler, request)
+                logging.info(f"profiled {request.method} {request.url.path}: {name}")
+            response.headers["X-Profile-Id"] = name
+            return response
+
+        return profiled_handler
+
+
+async def check_admin(request: Request):
+    if not valid_profile_token(request.headers.get(PROFILE_HEADER)):
+        raise BaseHTTPException(401, "unauthorized", "Unauthorized")
+
+
+async def list_profiles(request: Request) -> list[str]:
+    await check_admin(request)
+    directory = profiles_dir()
+    if not directory.exists():
+        return []
+    return sorted(
+        (path.name for path in directory.glob(f"*{PROFILE_SUFFIX}")), reverse=True
+    )
+
+
+async def retrieve_profile(request: Request, name: str):
+    await check_admin(request)
+    path = profiles_dir() / name
+    if (
+        not name.endswith(PROFILE_SUFFIX)
+        or path.parent != profiles_dir()
+        or not path.is_file()
+    ):
+        raise BaseHTTPException(404, "profile_not_found", "Profile not found")
+    # open the file at https://www.speedscope.app
+    return FileResponse(path, media_type="application/json", filename=name)
+
+
+router = APIRouter(prefix="/admin/profiles")
+router.add_api_route("/", list_profiles, methods=["GET"])
+router.add_api_route("/{name}", retrieve_profile, methods=["GET"])
@@ -0,0 +1,246 @@
+"""Bulkheads, circuit breakers and latency budgets of upstream calls.
+
+Every (upstream, ipg) pair gets its own bulkhead, a bounded number of calls
+in flight plus a bounded queue, and its own circuit breaker, so one slow
+gateway only exhausts its own slots. Each http request carries a latency
+budget in a context variable, and upstream calls made while serving it time
+out when the budget runs out.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from singleton import Singleton
+
+from server.config import Settings
+
+from .metrics import UPSTREAM_REJECTED
+
+deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call that was refused or ran out of budget."""
+
+    def __init__(self, upstream: str, ipg: str = None, reason: str = "unavailable"):
+        self.upstream = upstream
+        self.ipg = ipg
+        self.reason = reason
+        super().__init__(f"{ipg or upstream} {reason}")
+
+
+def remaining_budget() -> float | None:
+    """Seconds left of the current request's budget, None without one."""
+    at = deadline.get()
+    if at is None:
+        return None
+    return at - time.monotonic()
+
+
+@asynccontextmanager
+async def latency_budget(seconds: float):
+    """Bound the upstream calls of a block, never extending an outer budget."""
+    at = time.monotonic() + seconds
+    outer = deadline.get()
+    token = deadline.set(at if outer is None else min(outer, at))
+    try:
+        yield
+    finally:
+        deadline.reset(token)
+
+
+def shared_task(coro) -> asyncio.Task:
+    """Start a task shared by many callers, outside the current budget.
+
+    Tasks copy the context that creates them, so a shared load would otherwise
+    run under, and fail every waiter on, the budget of whoever started it.
+    """
+    context = contextvars.copy_context()
+    context.run(deadline.set, None)
+    return asyncio.create_task(coro, context=context)
+
+
+async def await_shared(task: asyncio.Task, upstream: str):
+    """Await a shared task within the caller's own budget, leaving it running."""
+    remaining = remaining_budget()
+    if remaining is None:
+        return await asyncio.shield(task)
+    budget = asyncio.timeout(remaining)
+    try:
+        async with budget:
+            return await asyncio.shield(task)
+    except TimeoutError as e:
+        if not budget.expired():
+            raise
+        raise reject(upstream, None, "budget_exhausted") from e
+
+
+class LatencyBudgetMiddleware:
+    """Give every http request `request_latency_budget` seconds of upstream calls."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or Settings.request_latency_budget <= 0:
+            return await self.app(scope, receive, send)
+        async with latency_budget(Settings.request_latency_budget):
+            await self.app(scope, receive, send)
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Timeouts, connection errors and 5xx responses, not client errors."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, TimeoutError))
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets one probe through after a while."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, success: bool | None):
+        """Record an outcome, `None` for calls that tell nothing about health."""
+        self.probing = False
+        if success is None:
+            return
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class Bulkhead:
+    """At most `max_concurrency` calls in flight and `max_queue` waiting."""
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_queue = max_queue
+        self.waiting = 0
+
+    def full(self) -> bool:
+        return self.semaphore.locked() and self.waiting >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+
+class UpstreamGuards(metaclass=Singleton):
+    """Bulkhead and circuit breaker of every (upstream, ipg)."""
+
+    def __init__(self):
+        self.guards: dict[tuple[str, str], tuple[Bulkhead, CircuitBreaker]] = {}
+
+    @staticmethod
+    def limits(upstream: str, ipg: str = None) -> dict:
+        try:
+            limits: dict = json.loads(Settings.upstream_limits)
+        except ValueError:
+            logging.error(f"Invalid UPSTREAM_LIMITS {Settings.upstream_limits}")
+            limits = {}
+        return {**limits.get(upstream, {}), **limits.get(ipg or "", {})}
+
+    def get(self, upstream: str, ipg: str = None) -> tuple[Bulkhead, CircuitBreaker]:
+        key = (upstream, ipg or "")
+        guard = self.guards.get(key)
+        if guard is None:
+            limits = self.limits(upstream, ipg)
+            guard = (
+                Bulkhead(
+                    limits.get("max_concurrency", Settings.upstream_max_concurrency),
+                    limits.get("max_queue", Settings.upstream_max_queue),
+                ),
+                CircuitBreaker(
+                    limits.get("failure_threshold", Settings.circuit_failure_threshold),
+                    limits.get("reset_timeout", Settings.circuit_reset_timeout),
+                ),
+            )
+            self.guards[key] = guard
+        return guard
+
+
+def reject(upstream: str, ipg: str | None, reason: str) -> UpstreamUnavailable:
+    UPSTREAM_REJECTED.labels(upstream, ipg or "", reason).inc()
+    return UpstreamUnavailable(upstream, ipg, reason)
+
+
+@asynccontextmanager
+async def upstream_guard(upstream: str, ipg: str = None):
+    """Run an upstream call in its bulkhead, breaker and the request budget.
+
+    Raises `UpstreamUnavailable` instead of calling when the circuit is open,
+    the bulkhead is full or the budget is spent, and when the budget runs out
+    during the call.
+    """
+    bulkhead, breaker = UpstreamGuards().get(upstream, ipg)
+    remaining = remaining_budget()
+    if remaining is not None and remaining <= 0:
+        raise reject(upstream, ipg, "budget_exhausted")
+    if bulkhead.full():
+        raise reject(upstream, ipg, "bulkhead_full")
+    if not breaker.allow():
+        raise reject(upstream, ipg, "circuit_open")
+
+    success = None
+    budget = asyncio.timeout(remaining)
+    try:
+        async with budget:
+            async with bulkhead.slot():
+                try:
+                    yield
+                except BaseException as e:
+                    if is_upstream_failure(e):
+                        success = False
+                    elif isinstance(e, httpx.HTTPStatusError):
+                        success = True
+                    raise
+                success = True
+    except TimeoutError as e:
+        if not budget.expired():
+            raise
+        success = False
+        raise reject(upstream, ipg, "budget_exhausted") from e
+    finally:
+        breaker.record(success)
@@ -0,0 +1,23 @@
+import pydantic_core
+from beanie import Document
+from fastapi import Response
+
+# beanie bookkeeping fields that are not part of the api schemas
+DOCUMENT_FIELDS = {"id", "revision_id"}
+
+
+def document_response(document: Document, status_code: int = 200, **fields) -> Response:
+    """Serialize a document straight to a json response.
+
+    The document's own compiled serializer writes the body, so there is no
+    dump to a dict and the route's response_model is not validated again.
+    Extra `fields`, e.g. lookups of a retrieve, are appended to the object,
+    and the document's `private_fields` are left out.
+    """
+    exclude = DOCUMENT_FIELDS | getattr(type(document), "private_fields", set())
+    body = document.__pydantic_serializer__.to_json(document, exclude=exclude)
+    if fields:
+        body = body[:-1] + b"," + pydantic_core.to_json(fields)[1:]
+    return Response(
+        content=body, status_code=status_code, media_type="application/json"
+    )